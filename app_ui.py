@@ -4,9 +4,13 @@ import tkinter as tk
 from tkinter import ttk
 from ui import NameBadgeUI, TroveLabelUI, GeneralLabelUI, DatabaseUI, UpdateDelayer
 from printer import DisplayPrinter
+from printerstatus import READY
+from spooler import PRINTER
+from worker import BackgroundWorker
+from tagservice import TagReaderService, TAG_ARRIVED
 
 class BadgerApp(ttk.Frame):
-    def __init__(self, master, printer=DisplayPrinter, tagreader=None, db=None, sound=None):
+    def __init__(self, master, printer=DisplayPrinter(), tagreader=None, db=None, sound=None):
         super().__init__(master)
         self.master = master
         self.pack()
@@ -16,12 +20,11 @@ class BadgerApp(ttk.Frame):
         self.db = db
         self.sound = sound
 
+        self.dbworker = BackgroundWorker(self) if db else None
+
         self.nb = ttk.Notebook(self)
         self.nb.pack()
 
-        self.event_add("<<Tag_Present>>", "None")
-        self.bind('<<Tag_Present>>', self.handle_tag)
-
         self.eraser = UpdateDelayer(self, self.clear_screens, update_delay_ms=30000)
 
         self.event_add("<<Interacted>>", "None")
@@ -30,30 +33,50 @@ class BadgerApp(ttk.Frame):
         self.namebadge_ui = NameBadgeUI(self.nb, self.printer)
         self.trovelabel_ui = TroveLabelUI(self.nb, self.printer)
         self.general_ui = GeneralLabelUI(self.nb, self.printer)
-        self.db_ui = DatabaseUI(self.nb, self.db, self.printer)
+        self.db_ui = DatabaseUI(self.nb, self.db, self.printer, self.dbworker)
 
         self.nb.add(self.namebadge_ui, text="Name Badge")
         self.nb.add(self.trovelabel_ui, text="Storage Label")
         self.nb.add(self.general_ui, text="General Label")
         self.nb.add(self.db_ui, text="Edit Tag")
 
-        if self.tagreader:
-            self.wait_for_tag_gone = None
-            self.after(100, self.__check_for_tag)
+        self.status_var = tk.StringVar(self, "")
+        self.status_lbl = ttk.Label(self, textvariable=self.status_var)
+        self.status_lbl.pack()
 
-    def __check_for_tag(self):
-        tag = self.tagreader.read_tag()
-        if tag:
-            if tag == self.wait_for_tag_gone:
-                self.after(100, self.__check_for_tag)
-                return
+        self.after(200, self.__check_print_status)
 
-            self.wait_for_tag_gone = tag
-            self.event_generate("<<Tag_Present>>")
-        else:
-            self.wait_for_tag_gone = None
+        if self.tagreader:
+            # The reader is polled on its own thread, we just pick up the
+            # events it generates
+            self.tagservice = TagReaderService(self.tagreader)
+            self.tagservice.start()
+            self.after(50, self.__check_for_tag)
 
-        self.after(300, self.__check_for_tag)
+    def __check_for_tag(self):
+        for event in self.tagservice.get_events():
+            if event.kind == TAG_ARRIVED:
+                self.handle_tag(event)
+
+        self.after(50, self.__check_for_tag)
+
+    # Print jobs run in the background, so just report how they're getting on
+    def __check_print_status(self):
+        for job_id, state, info in self.printer.poll_status():
+            if state == PRINTER:
+                # info is the printer's state. Once it's ready again, clear the
+                # message, unless something else has been shown since.
+                if info != READY:
+                    self.status_var.set(f"Printer {info}")
+                elif self.status_var.get().startswith("Printer "):
+                    self.status_var.set("")
+            elif info:
+                print(f"Print job {job_id} {state}: {info}")
+                self.status_var.set(f"Label {job_id}: {state} ({info})")
+            else:
+                self.status_var.set(f"Label {job_id}: {state}")
+
+        self.after(200, self.__check_print_status)
 
     def handle_interacted(self, event):
         self.eraser.set_modified()
@@ -70,15 +93,17 @@ class BadgerApp(ttk.Frame):
 
         self.eraser.set_modified()
 
-        tag = self.tagreader.read_tag()
-        if tag and tag == self.wait_for_tag_gone:
+        tag = event.tag
+        buttons = event.buttons
+        if tag:
             if self.sound:
-                self.sound.beep()
-            buttons = self.tagreader.read_buttons()
+                self.sound.beep(event.timestamp)
             print(f"tag: {tag.hex()}, buttons: {buttons}")
 
             # Special case the "General" tag
             if tag.hex() == "4777701c":
+                if self.dbworker:
+                    self.dbworker.invalidate('tag')
                 self.nb.select(self.general_ui)
                 self.general_ui.reset()
                 return
@@ -87,33 +112,49 @@ class BadgerApp(ttk.Frame):
             if not self.db:
                 return
 
-            # Look up tag details in database
-            try:
-                name, comment = self.db.lookup(tag)
-            except Exception as e:
-                print("Tag not in database, enrol it", e)
-                self.db_ui.populate(tag, "Your Name", "Your Comment")
-                self.nb.select(self.db_ui)
-                return
-
-            if buttons == 0: # Print name badge
-                self.namebadge_ui.populate(name, comment)
-                self.nb.select(self.namebadge_ui)
-                self.namebadge_ui.event_generate("<<Print_Label>>")
-                self.trovelabel_ui.populate(name, comment)
-            elif buttons == 1:
-                self.db_ui.populate(tag, name, comment)
-                self.nb.select(self.db_ui)
-                self.namebadge_ui.populate(name, comment)
-            elif buttons == 2: # Show storage tab
-                self.trovelabel_ui.populate(name, comment)
-                self.nb.select(self.trovelabel_ui)
-                self.namebadge_ui.populate(name, comment)
-            elif buttons == 3:
-                print(f"Erase tag: {tag}")
-                try:
-                    self.db.delete(tag)
-                    self.db_ui.populate(tag, "Your Name", "Your Comment")
-                    self.nb.select(self.db_ui)
-                except Exception as e:
-                    print("Erase failed:", e)
+            # Look up tag details in database, without blocking the UI.
+            # Any lookup still running for an earlier tag gets discarded.
+            self.status_var.set(f"Looking up tag {tag.hex()}...")
+            self.dbworker.submit(self.db.lookup, tag, key='tag',
+                                 on_done=lambda result: self.__handle_tag_found(tag, buttons, *result),
+                                 on_error=lambda e: self.__handle_tag_not_found(tag, e))
+
+    def __handle_tag_not_found(self, tag, e):
+        self.status_var.set("")
+        print("Tag not in database, enrol it", e)
+        self.db_ui.populate(tag, "Your Name", "Your Comment")
+        self.nb.select(self.db_ui)
+
+    def __handle_tag_found(self, tag, buttons, name, comment):
+        self.status_var.set("")
+
+        if buttons == 0: # Print name badge
+            self.namebadge_ui.populate(name, comment)
+            self.nb.select(self.namebadge_ui)
+            self.namebadge_ui.event_generate("<<Print_Label>>")
+            self.trovelabel_ui.populate(name, comment)
+        elif buttons == 1:
+            self.db_ui.populate(tag, name, comment)
+            self.nb.select(self.db_ui)
+            self.namebadge_ui.populate(name, comment)
+        elif buttons == 2: # Show storage tab
+            self.trovelabel_ui.populate(name, comment)
+            self.nb.select(self.trovelabel_ui)
+            self.namebadge_ui.populate(name, comment)
+        elif buttons == 3:
+            print(f"Erase tag: {tag}")
+            self.status_var.set(f"Erasing tag {tag.hex()}...")
+            # No key: a later tag mustn't stop the delete. Calls run in order,
+            # so a later lookup's result still arrives after this one.
+            self.dbworker.submit(self.db.delete, tag,
+                                 on_done=lambda _: self.__handle_tag_erased(tag),
+                                 on_error=self.__handle_erase_failed)
+
+    def __handle_tag_erased(self, tag):
+        self.status_var.set("")
+        self.db_ui.populate(tag, "Your Name", "Your Comment")
+        self.nb.select(self.db_ui)
+
+    def __handle_erase_failed(self, e):
+        self.status_var.set("")
+        print("Erase failed:", e)
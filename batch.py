@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import collections
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+
+from label import Label
+from raster import pack_image
+from stats import stats
+
+# Batch printing, e.g. name badges for everyone on a member list.
+#
+# Labels are laid out, rendered and packed in a pool of worker processes,
+# and the packed rasters are sent to the printer in order from this process.
+# A few labels are kept in flight ahead of the one being sent, so the
+# printer never has to wait for rendering.
+
+# Read the rows of a CSV file (with a header row) or a JSONL file, as dicts
+def read_rows(filename, fmt=None):
+    if fmt is None:
+        fmt = 'jsonl' if filename.endswith(('.jsonl', '.json')) else 'csv'
+
+    with open(filename, newline='') as f:
+        if fmt == 'jsonl':
+            return [json.loads(line) for line in f if line.strip()]
+        elif fmt == 'csv':
+            return list(csv.DictReader(f))
+
+    raise ValueError(f"unknown batch file format '{fmt}'")
+
+# Work out the text for a row. Rows can have:
+#  - 'lines': a list of lines (JSONL only), each either text or a list of
+#    columns, as for Label
+#  - 'tag': a tag ID (hex) to look up in the database, for a name badge
+#  - 'name' and/or 'comment': text for a name badge
+def row_lines(row, db=None):
+    if row.get('lines'):
+        return row['lines']
+
+    if row.get('tag'):
+        if db is None:
+            raise ValueError("row has a tag, but there's no database")
+        name, comment = db.lookup(bytes.fromhex(row['tag']))
+    else:
+        name, comment = row.get('name'), row.get('comment')
+
+    lines = [l for l in (name, comment) if l]
+    if len(lines) == 0:
+        raise ValueError("nothing to print")
+
+    return lines
+
+# Runs in a worker process
+def _render(lines, dpi, size_mm, padding_mm, ink, rotate, model):
+    img = Label(lines, dpi, size_mm, Label.Padding(*padding_mm)).image()
+    with stats.timer("pack", model):
+        return pack_image(img, ink=ink, rotate=rotate)
+
+# Print 'rows' (numbered from 1) on 'printer', which must have print_raster(),
+# starting from row 'start_row'.
+#
+# Yields (row number, error) as each row is finished with, where error is
+# None if it was printed. Rows which can't be looked up or rendered stop the
+# batch, unless skip_errors is set. A printer error always stops the batch.
+def run_batch(rows, printer, db=None, start_row=1, size_mm=(89, 36), rotate=0,
+              skip_errors=False, workers=None, lookahead=None):
+    render_args = (printer.dpi, size_mm, printer.padding(), printer.ink, rotate, printer.model)
+
+    todo = ((n, row) for n, row in enumerate(rows, 1) if n >= start_row)
+    pending = collections.deque()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if lookahead is None:
+        lookahead = 2 * workers
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        def refill():
+            for n, row in itertools.islice(todo, lookahead - len(pending)):
+                try:
+                    fut = pool.submit(_render, row_lines(row, db), *render_args)
+                except Exception as e:
+                    fut = concurrent.futures.Future()
+                    fut.set_exception(e)
+                pending.append((n, fut))
+
+        try:
+            refill()
+            while pending:
+                n, fut = pending.popleft()
+                try:
+                    raster = fut.result()
+                except Exception as e:
+                    if not skip_errors:
+                        raise RuntimeError(f"row {n}: {e} (resume with --start-row {n})")
+                    refill()
+                    yield n, e
+                    continue
+
+                # Queue up more rendering before blocking on the printer
+                refill()
+
+                try:
+                    printer.print_raster(raster)
+                except Exception as e:
+                    raise RuntimeError(f"row {n}: printer: {e} (resume with --start-row {n})")
+
+                yield n, None
+        finally:
+            pool.shutdown(cancel_futures=True)
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+
+from db import Database
+from db_sett import Database as RemoteDatabase
+from fakeserver import FakeMemberServer
+from fakeusb import fake_endpoints
+from label import Label, LineFitCache, image_cache, layout_cache, rasterize
+from printer import RotatePrinter
+from printer_d450 import PrinterDymo450
+from printer_tspl import PrinterVretti420B
+from raster import pack_image
+from stats import stats
+import argparse
+import json
+import platform
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+from PIL import Image
+
+# The original per-pixel encoder from the printer drivers, kept here to
+# benchmark against and to check that pack_image() produces identical output.
+# ink=1 is the Dymo encoding, ink=0 the TSPL one.
+def pack_image_loop(image, ink=1):
+    width = image.width
+    height = image.height
+    image_data = image.getdata()
+
+    nbytes = (width + 7) // 8
+
+    buf = bytearray()
+    for row in range(height):
+        line = bytearray(nbytes)
+        for byte, _ in enumerate(line):
+            b = 0 if ink else 0xff
+            for bit in range(8):
+                col = (byte * 8) + bit
+                if col >= width:
+                    break
+
+                idx = row * width + col
+                v = image_data[idx]
+                if v == 0:
+                    if ink:
+                        b |= (1 << (7 - bit))
+                    else:
+                        b &= ~(1 << (7 - bit))
+            line[byte] = b
+        buf += line
+
+    return bytes(buf)
+
+def time_ms(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1e3
+
+def bench_raster(args):
+    lines = ["Benchmark Badge", "benchmark@example.com"]
+
+    for dpi in [203, 300]:
+        # Drivers are always handed the rotated label
+        image = Label(lines, dpi).image().transpose(Image.Transpose.ROTATE_90)
+
+        for name, ink in [('d450', 1), ('tspl', 0)]:
+            if pack_image(image, ink).data != pack_image_loop(image, ink):
+                raise RuntimeError(f"{name} encoder output differs at {dpi} dpi")
+
+            loop_ms = time_ms(lambda: pack_image_loop(image, ink), args.repeat)
+            bulk_ms = time_ms(lambda: pack_image(image, ink), args.repeat)
+            print(f"{name} @ {dpi} dpi ({image.width}x{image.height}): "
+                  f"loop {loop_ms:.2f} ms, bulk {bulk_ms:.3f} ms, {loop_ms / bulk_ms:.0f}x")
+
+# The original ways of sending a raster, a transfer per line for the Dymo and
+# the whole canvas as one BITMAP for TSPL, to compare USB usage against
+def print_rows_d450(printer, raster):
+    printer.sync()
+    printer.write_command(ord('D'), [raster.stride])
+    nrows = raster.height + 100
+    printer.write_command(ord('L'), [nrows // 256, nrows % 256])
+    for line in raster.rows():
+        printer.write_data(line)
+    printer.form_feed()
+
+def print_canvas_tspl(printer, raster):
+    printer.write_command(f"SIZE {raster.height},{raster.width}")
+    printer.write_command("DIRECTION 0")
+    printer.write_command("CLS")
+    printer.ep_out.write(bytes(f"\r\nBITMAP 70,0,{raster.stride},{raster.height},0,", "utf-8") +
+                         raster.data + b"\r\n")
+    printer.write_command("PRINT 1,1")
+
+def bench_usb(args):
+    printers = [
+        ('d450', PrinterDymo450, print_rows_d450),
+        ('tspl', PrinterVretti420B, print_canvas_tspl),
+    ]
+
+    for name, printer_class, print_old in printers:
+        endpoints = fake_endpoints()
+        ep_out = endpoints[0]
+        printer = printer_class(endpoints=endpoints)
+
+        for label_name, lines in LABEL_LINES.items():
+            padding = Label.Padding(*printer.padding())
+            image = Label(lines, printer.dpi, padding_mm=padding).image()
+            raster = pack_image(image, printer.ink, rotate=90)
+
+            usage = []
+            for send in (print_old, type(printer).print_raster):
+                ep_out.reset_counters()
+                send(printer, raster)
+                usage.append((ep_out.transfers, ep_out.bytes_written))
+
+            (old_transfers, old_bytes), (new_transfers, new_bytes) = usage
+            print(f"{name} {label_name:10} transfers {old_transfers:4} -> {new_transfers:3}, "
+                  f"bytes {old_bytes:6} -> {new_bytes:6}")
+
+# The original Tags layout and queries (a rowid table with a UNIQUE index,
+# SQL built by concatenation, default rollback journal), for comparison
+def old_db_lookup(conn, tag):
+    cur = conn.cursor()
+    cur.execute("SELECT Name, Comment FROM Tags WHERE Tag = x'"+tag.hex()+"'")
+    return cur.fetchone()
+
+def old_db_insert(conn, tag, name, comment):
+    cur = conn.cursor()
+    cur.execute("INSERT INTO Tags VALUES(x'"+tag.hex()+"', ?, ?)", (name, comment))
+    conn.commit()
+
+def bench_db_layouts(args):
+    nlookups = 1000
+    ninserts = 200
+
+    for size in args.db_sizes:
+        rng = random.Random(size)
+        tags = list({rng.randbytes(4) for _ in range(size + ninserts)})
+        new_tags = tags[size:]
+        tags = tags[:size]
+        rows = [(tag, f"Member {i}", "member@example.com") for i, tag in enumerate(tags)]
+        lookups = rng.sample(tags, min(nlookups, len(tags)))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            old = sqlite3.connect(os.path.join(tmpdir, "old.db"))
+            old.execute("CREATE TABLE Tags(Tag BLOB UNIQUE, Name TEXT, Comment TEXT)")
+            old.executemany("INSERT INTO Tags VALUES(?, ?, ?)", rows)
+            old.commit()
+
+            new = Database(os.path.join(tmpdir, "new.db"))
+            new.initialise()
+            new.conn.executemany("INSERT INTO Tags VALUES(?, ?, ?)", rows)
+            new.conn.commit()
+
+            def lookup_old():
+                for tag in lookups:
+                    old_db_lookup(old, tag)
+            def lookup_new():
+                for tag in lookups:
+                    new.lookup(tag)
+
+            old_us = time_ms(lookup_old, args.repeat) * 1e3 / len(lookups)
+            new_us = time_ms(lookup_new, args.repeat) * 1e3 / len(lookups)
+            print(f"{size} tags: lookup {old_us:.2f} us -> {new_us:.2f} us")
+
+            start = time.perf_counter()
+            for tag in new_tags:
+                old_db_insert(old, tag, "New Member", "member@example.com")
+            old_us = (time.perf_counter() - start) * 1e6 / len(new_tags)
+
+            start = time.perf_counter()
+            for tag in new_tags:
+                new.insert(tag, "New Member", "member@example.com")
+            new_us = (time.perf_counter() - start) * 1e6 / len(new_tags)
+            print(f"{size} tags: insert + commit {old_us:.1f} us -> {new_us:.1f} us")
+
+            old.close()
+            new.close()
+
+# Collects timings for a set of named benchmarks.
+# Each benchmark is timed 'repeat' times, and each timing is divided by
+# 'per' so that e.g. a loop of database lookups reports the time per lookup.
+class Suite():
+    def __init__(self, repeat=5, only=None):
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+    def wanted(self, name):
+        return not self.only or any(o in name for o in self.only)
+
+    def run(self, name, func, per=1):
+        if not self.wanted(name):
+            return
+
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1e3 / per)
+
+        result = {
+            "min_ms": min(times),
+            "median_ms": statistics.median(times),
+        }
+        self.results[name] = result
+        print(f"{name:32} {result['min_ms']:10.4f} ms  (median {result['median_ms']:.4f} ms)")
+
+    def skip(self, name, reason):
+        if self.wanted(name):
+            print(f"{name:32} skipped: {reason}")
+
+LABEL_LINES = {
+    '1-line': ["Makespace Member"],
+    '2-lines': ["Makespace Member", "member@example.com"],
+    '3-lines': ["Makespace Member", "member@example.com", "Trustee, Laser Cutter"],
+    '12-lines': [f"Line {i}: a general label with quite a lot of text" for i in range(12)],
+    'columns': [["Makespace Member"], ["member@example.com"],
+                ["Date in: 2024-01-01", "Use by: 2024-01-31"]],
+}
+
+def bench_labels(suite):
+    for name, lines in LABEL_LINES.items():
+        def render():
+            image_cache.clear()
+            layout_cache.clear()
+            Label(lines, 300, padding_mm=Label.Padding(2, 0, 2, 0)).image()
+        suite.run(f"label/{name}", render)
+
+        # Drawing an existing layout, e.g. for a second printer
+        layout = Label(lines, 300, padding_mm=Label.Padding(2, 0, 2, 0)).layout()
+        def rasterize_203():
+            image_cache.clear()
+            rasterize(layout, 203)
+        suite.run(f"rasterize/{name}", rasterize_203)
+
+    # Editing one line of a long general label, as the preview does
+    lines = LABEL_LINES['12-lines']
+    fit_cache = LineFitCache()
+    Label(lines, 300, fit_cache=fit_cache).layout()
+    count = [0]
+    def edit():
+        count[0] += 1
+        edited = lines[:5] + [f"Line 5: edited {count[0]}"] + lines[6:]
+        layout_cache.clear()
+        Label(edited, 300, fit_cache=fit_cache).layout()
+    suite.run("layout/edit-12-lines", edit)
+
+def bench_printers(suite):
+    lines = LABEL_LINES['2-lines']
+    printers = [
+        ('d450', PrinterDymo450, 1),
+        ('tspl', PrinterVretti420B, 0),
+    ]
+
+    for name, printer_class, ink in printers:
+        printer = printer_class(endpoints=fake_endpoints())
+        image = Label(lines, printer.dpi).image()
+        rotated = image.transpose(Image.Transpose.ROTATE_90)
+
+        suite.run(f"encode/{name}", lambda: pack_image(rotated, ink))
+        suite.run(f"encode-rotate/{name}", lambda: pack_image(image, ink, rotate=90))
+        suite.run(f"print/{name}", lambda: printer.print_image(rotated))
+        suite.run(f"rotate/{name}", lambda: RotatePrinter(printer).print_image(image))
+
+def bench_db(suite, sizes):
+    nlookups = 1000
+
+    for size in sizes:
+        name = f"db/lookup-{size // 1000}k"
+        if not suite.wanted(name):
+            continue
+
+        rng = random.Random(size)
+        tags = list({rng.randbytes(4) for _ in range(size)})
+
+        db = Database(':memory:')
+        db.initialise()
+        db.conn.executemany("INSERT INTO Tags VALUES(?, ?, ?)",
+                            ((tag, f"Member {i}", "member@example.com") for i, tag in enumerate(tags)))
+        db.conn.commit()
+
+        lookups = rng.sample(tags, min(nlookups, len(tags)))
+        def lookup():
+            for tag in lookups:
+                db.lookup(tag)
+        suite.run(name, lookup, per=len(lookups))
+
+        db.close()
+
+def bench_remote(suite):
+    if not suite.wanted("remote/"):
+        return
+
+    server = FakeMemberServer().start()
+    tag = bytes.fromhex("4777701d")
+
+    uncached = RemoteDatabase(server.base_url, cache_ttl=0)
+    uncached.insert(tag, "Makespace Member", "member@example.com")
+    cached = RemoteDatabase(server.base_url)
+
+    nlookups = 100
+    def lookup(db):
+        for _ in range(nlookups):
+            db.lookup(tag)
+    suite.run("remote/lookup", lambda: lookup(uncached), per=nlookups)
+    suite.run("remote/lookup-cached", lambda: lookup(cached), per=nlookups)
+
+    uncached.close()
+    cached.close()
+    server.stop()
+
+def bench_preview(suite):
+    names = ["preview/update", "preview/render"]
+    if not any(suite.wanted(name) for name in names):
+        return
+
+    try:
+        import tkinter as tk
+        from ui import LabelPreview, render_executor
+        root = tk.Tk()
+    except Exception as e:
+        for name in names:
+            suite.skip(name, e)
+        return
+
+    root.withdraw()
+    preview = LabelPreview(root, 400, 300, padding_mm=(2, 0, 2, 0))
+
+    # Every update has new text, like typing
+    count = [0]
+    def update():
+        count[0] += 1
+        preview.update(["Makespace Member", f"member{count[0]}@example.com"])
+
+    # Time spent on the Tk thread
+    suite.run("preview/update", update)
+
+    # ...and until the render thread has finished with it
+    def update_and_render():
+        update()
+        render_executor.submit(lambda: None).result()
+    suite.run("preview/render", update_and_render)
+
+    root.destroy()
+
+# Command lines to time the cold start of, run from the repo directory.
+# The UI needs a display to actually start, so for that only the imports
+# run_ui() needs are timed.
+STARTUP_TAG = "4777701d"
+STARTUP_COMMANDS = {
+    'lookup': lambda tmpdir: ['main.py', 'lookup', '-d', os.path.join(tmpdir, 'startup.db'), STARTUP_TAG],
+    'label': lambda tmpdir: ['main.py', 'label', '--out', os.path.join(tmpdir, 'startup.png'), 'Makespace Member'],
+    'ui': lambda tmpdir: ['-c', 'import tkinter, multiprocessing, printer, spooler, app_ui, tagreader, fakereader, fonts, label, db'],
+}
+
+def startup_db(tmpdir):
+    db = Database(os.path.join(tmpdir, 'startup.db'))
+    db.initialise()
+    db.insert(bytes.fromhex(STARTUP_TAG), "Makespace Member", "member@example.com")
+    db.close()
+
+def run_startup(command, importtime=False):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + command
+    return subprocess.run(cmd, cwd=here, check=True, capture_output=True, text=True)
+
+def bench_startup(suite):
+    names = [f"startup/{name}" for name in STARTUP_COMMANDS]
+    if not any(suite.wanted(name) for name in names):
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        startup_db(tmpdir)
+        for name, command in STARTUP_COMMANDS.items():
+            suite.run(f"startup/{name}", lambda: run_startup(command(tmpdir)))
+
+# Where the start-up time goes: the slowest top-level imports (as reported by
+# -X importtime) for each command
+def top_level_imports(command):
+    imports = []
+    for line in run_startup(command, importtime=True).stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        if not module.startswith("  "):
+            imports.append((int(cumulative_us) / 1e3, module.strip()))
+    return imports
+
+def bench_importtime(args):
+    # Imported by the interpreter itself, whatever the command
+    interpreter = {module for _, module in top_level_imports(['-c', 'pass'])}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        startup_db(tmpdir)
+        for name, command in STARTUP_COMMANDS.items():
+            total_ms = time_ms(lambda: run_startup(command(tmpdir)), args.repeat)
+
+            imports = [(ms, module) for ms, module in top_level_imports(command(tmpdir))
+                       if module not in interpreter]
+
+            imports.sort(reverse=True)
+            top = ", ".join(f"{module} {ms:.1f}" for ms, module in imports[:args.top])
+            print(f"{name:8} {total_ms:7.1f} ms  (slowest imports, ms: {top})")
+
+# The cost of timing a stage, which is always on
+def bench_stats(suite):
+    n = 10000
+    def timer():
+        for _ in range(n):
+            with stats.timer("bench"):
+                pass
+    suite.run("stats/timer", timer, per=n)
+
+def run_suite(args):
+    suite = Suite(args.repeat, args.only)
+
+    bench_labels(suite)
+    bench_printers(suite)
+    bench_db(suite, args.db_sizes)
+    bench_remote(suite)
+    bench_preview(suite)
+    bench_startup(suite)
+    bench_stats(suite)
+
+    return suite.results
+
+def save_results(results, filename):
+    out = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(filename, 'w') as f:
+        json.dump(out, f, indent=2)
+
+def bench_run(args):
+    results = run_suite(args)
+    if args.out:
+        save_results(results, args.out)
+
+def bench_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+
+    results = run_suite(args)
+    if args.out:
+        save_results(results, args.out)
+
+    print()
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base_ms = baseline[name]["min_ms"]
+        change = ((result["min_ms"] / base_ms) - 1) * 100 if base_ms else 0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:32} {base_ms:10.4f} -> {result['min_ms']:10.4f} ms  {change:+7.1f}%{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold}%")
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='badger-ng-benchmark',
+                        description='Makespace Badger benchmarks')
+
+    subparsers = parser.add_subparsers(title="Sub-commands")
+
+    raster_parser = subparsers.add_parser('raster', add_help=True,
+                                          description='Compare the per-pixel and bulk raster encoders',
+                                          help='Compare the per-pixel and bulk raster encoders')
+    raster_parser.add_argument('--repeat', help='Number of timing runs', type=int, default=5)
+    raster_parser.set_defaults(func=bench_raster)
+
+    db_parser = subparsers.add_parser('db', add_help=True,
+                                      description='Compare the original and current Tags table layout and queries',
+                                      help='Compare the original and current Tags table layout and queries')
+    db_parser.add_argument('--repeat', help='Number of timing runs', type=int, default=5)
+    db_parser.add_argument('--db-sizes', help='Comma-separated database sizes (tags)',
+                           type=lambda s: [int(n) for n in s.split(',')], default=[10000, 100000, 1000000])
+    db_parser.set_defaults(func=bench_db_layouts)
+
+    usb_parser = subparsers.add_parser('usb', add_help=True,
+                                       description='Count the USB transfers and bytes sent per label, before and after bulk sending',
+                                       help='Count the USB transfers and bytes sent per label')
+    usb_parser.set_defaults(func=bench_usb)
+
+    startup_parser = subparsers.add_parser('startup', add_help=True,
+                                           description='Time the cold start of main.py commands, and show the slowest imports',
+                                           help='Time the cold start of main.py commands')
+    startup_parser.add_argument('--repeat', help='Number of timing runs', type=int, default=5)
+    startup_parser.add_argument('--top', help='Number of imports to show', type=int, default=5)
+    startup_parser.set_defaults(func=bench_importtime)
+
+    # Common arguments for running the suite
+    suite_parser = argparse.ArgumentParser(description="parent parser for suite commands", add_help = False)
+    suite_parser.add_argument('--repeat', help='Number of timing runs', type=int, default=5)
+    suite_parser.add_argument('--only', help='Only run benchmarks whose name contains this (repeatable)', action='append')
+    suite_parser.add_argument('--db-sizes', help='Comma-separated database sizes (tags)',
+                              type=lambda s: [int(n) for n in s.split(',')], default=[10000, 100000, 1000000])
+    suite_parser.add_argument('--out', help='Save results to this JSON file', default=None)
+
+    run_parser = subparsers.add_parser('run', add_help=True,
+                                       parents=[suite_parser],
+                                       description='Run the benchmark suite',
+                                       help='Run the benchmark suite')
+    run_parser.set_defaults(func=bench_run)
+
+    compare_parser = subparsers.add_parser('compare', add_help=True,
+                                           parents=[suite_parser],
+                                           description='Run the benchmark suite and compare against a baseline',
+                                           help='Run the benchmark suite and compare against a baseline')
+    compare_parser.add_argument('--threshold', help='Slow-down (%%) to flag as a regression', type=float, default=10)
+    compare_parser.add_argument('baseline', help='Baseline JSON file from "run --out"')
+    compare_parser.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
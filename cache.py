@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import threading
+
+# Default sizes of the process-wide caches, fonts.font_cache and
+# label.image_cache. They're here rather than with the caches, so that
+# main.py can show them in --help without importing Pillow.
+DEFAULT_FONT_CACHE_SIZE = 64
+DEFAULT_IMAGE_CACHE_BYTES = 16 * 1024 * 1024
+
+# A bounded least-recently-used cache.
+#
+# By default every entry counts as 1 towards maxsize. Passing a sizeof
+# function lets the limit be expressed in other units (e.g. bytes), in which
+# case the least recently used entries are evicted until the total fits.
+class LRUCache:
+    def __init__(self, maxsize=128, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof if sizeof else lambda value: 1
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.sizeof(self.entries.pop(key))
+
+            self.entries[key] = value
+            self.size += self.sizeof(value)
+            self.__evict()
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries.pop(key)
+            self.size -= self.sizeof(value)
+            return value
+
+    # Return the cached value for key, calling load() to create it on a miss
+    def get_or_load(self, key, load):
+        value = self.get(key)
+        if value is None:
+            value = load()
+            self.put(key, value)
+        return value
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.__evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+    def __evict(self):
+        while self.size > self.maxsize and self.entries:
+            _, value = self.entries.popitem(last=False)
+            self.size -= self.sizeof(value)
+            self.evictions += 1
@@ -2,48 +2,101 @@
 
 import sqlite3 as sqlite
 
+from stats import stats
+
+# Bumped whenever the schema changes, stored in the database's user_version
+SCHEMA_VERSION = 1
+
+# The tag is the primary key, and without a rowid the rows are stored in
+# the primary key's b-tree, so a lookup is a single index search.
+CREATE_TAGS = "CREATE TABLE {table}(Tag BLOB PRIMARY KEY NOT NULL, Name TEXT, Comment TEXT) WITHOUT ROWID"
+
 class Database():
-    def __init__(self, dbfile):
-        self.conn = sqlite.connect(dbfile)
+    def __init__(self, dbfile, readonly=False):
+        # The UI makes its database calls from a worker thread, but only
+        # ever one at a time, so the connection doesn't need to be tied to
+        # the thread which opened it.
+        if readonly:
+            self.conn = sqlite.connect(f'file:{dbfile}?mode=ro', uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite.connect(dbfile, check_same_thread=False)
+            # WAL makes each commit an append to the log, and with
+            # synchronous=NORMAL it's only synced at checkpoints. That's
+            # still safe against corruption, though a power cut can lose
+            # the last few writes.
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.__migrate()
+
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-8192")
+        self.conn.execute("PRAGMA mmap_size=67108864")
 
     def close(self):
         self.conn.close()
         self.conn = None
 
+    # Databases created before SCHEMA_VERSION 1 have a rowid table with a
+    # separate UNIQUE index on Tag. Copy them to the current layout.
+    def __migrate(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        res = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='Tags'").fetchone()
+        if res is None:
+            # Empty database, wait for initialise()
+            return
+
+        try:
+            self.conn.executescript(f"""
+                BEGIN IMMEDIATE;
+                {CREATE_TAGS.format(table='Tags_new')};
+                INSERT OR IGNORE INTO Tags_new SELECT Tag, Name, Comment FROM Tags WHERE Tag IS NOT NULL;
+                DROP TABLE Tags;
+                ALTER TABLE Tags_new RENAME TO Tags;
+                PRAGMA user_version = {SCHEMA_VERSION};
+                COMMIT;
+            """)
+        except:
+            self.conn.rollback()
+            raise
+
     def initialise(self):
         cur = self.conn.cursor()
-        cur.execute("CREATE TABLE Tags(Tag BLOB UNIQUE, Name TEXT, Comment TEXT)")
+        cur.execute(CREATE_TAGS.format(table='Tags'))
+        cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         self.conn.commit()
 
     def lookup(self, tag):
-        cur = self.conn.cursor()
-        cur.execute("SELECT Name, Comment FROM Tags WHERE Tag = x'"+tag.hex()+"'")
-        res = cur.fetchone()
+        with stats.timer("lookup"):
+            cur = self.conn.cursor()
+            cur.execute("SELECT Name, Comment FROM Tags WHERE Tag = ?", (bytes(tag),))
+            res = cur.fetchone()
         if res is None:
             raise ValueError("tag not found")
         return res
 
     def update(self, tag, name, comment):
-        t = (name, comment)
+        t = (name, comment, bytes(tag))
         cur = self.conn.cursor()
-        # seems you can't use variables in a where clause...
-        cur.execute("UPDATE Tags SET Name=?, Comment=? WHERE Tag=x'"+tag.hex()+"'", t)
+        cur.execute("UPDATE Tags SET Name=?, Comment=? WHERE Tag=?", t)
         self.conn.commit()
         if cur.rowcount != 1:
             raise Exception("tag update failed - does it exist?")
 
     def delete(self, tag):
         cur = self.conn.cursor()
-        # seems you can't use variables in a where clause...
-        cur.execute("DELETE FROM Tags WHERE Tag=x'"+tag.hex()+"'")
+        cur.execute("DELETE FROM Tags WHERE Tag=?", (bytes(tag),))
         self.conn.commit()
         if cur.rowcount != 1:
             raise Exception("tag update failed - does it exist?")
 
     def insert(self, tag, name, comment):
-        t = (name, comment)
+        t = (bytes(tag), name, comment)
         cur = self.conn.cursor()
-        cur.execute("INSERT INTO Tags VALUES(x'"+tag.hex()+"', ?, ?)", t)
+        cur.execute("INSERT INTO Tags VALUES(?, ?, ?)", t)
         self.conn.commit()
         if cur.rowcount != 1:
             raise Exception("tag insert failed")
@@ -1,42 +1,89 @@
 #!/usr/bin/env python3
 import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import LRUCache
+from stats import stats
 
 class Database():
-    def __init__(self, base_url):
+    # timeouts are in seconds, cache_ttl=0 disables the lookup cache.
+    #
+    # A lookup happens on every tag scan, so the defaults give up quickly: a
+    # request is tried (retries + 1) times, each waiting up to connect_timeout
+    # + read_timeout, with backoff between them. That's about 6 s at worst
+    # with the defaults, but e.g. read_timeout=5, retries=2 would be over 15 s.
+    def __init__(self, base_url, connect_timeout=1.05, read_timeout=2,
+                 retries=1, backoff=0.2, cache_ttl=300, cache_size=1024):
         self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+
+        # One session for everything, so the connection (and TLS session)
+        # is kept alive between requests.
+        # Only idempotent methods are retried - not POST.
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=4)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # tag -> (expiry time, (name, contact))
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache(cache_size)
 
     def close(self):
-        pass
+        self.session.close()
 
     def initialise(self):
         raise NotImplementedError()
 
+    def __cache_put(self, tag, name, comment):
+        if self.cache_ttl > 0:
+            self.cache.put(bytes(tag), (time.monotonic() + self.cache_ttl, (name, comment)))
+
     def lookup(self, tag):
-        r = requests.get(self.base_url + "/api/v1/member/" + tag.hex())
-        if r.status_code != 200:
-            raise RuntimeError(f"request failed: {r.status_code}")
+        with stats.timer("lookup"):
+            cached = self.cache.get(bytes(tag))
+            if cached is not None:
+                expiry, result = cached
+                if time.monotonic() < expiry:
+                    return result
+
+            r = self.session.get(self.base_url + "/api/v1/member/" + tag.hex(), timeout=self.timeout)
+            if r.status_code != 200:
+                raise RuntimeError(f"request failed: {r.status_code}")
 
-        result = r.json()
-        return result["name"], result["contactData"]
+            result = r.json()
+            self.__cache_put(tag, result["name"], result["contactData"])
+            return result["name"], result["contactData"]
 
     def update(self, tag, name, comment):
         payload = { "fobId": tag.hex(), "name": name, "contactData": comment }
 
-        r = requests.put(self.base_url + "/api/v1/member/" + tag.hex(), json=payload)
+        self.cache.pop(bytes(tag))
+        r = self.session.put(self.base_url + "/api/v1/member/" + tag.hex(), json=payload, timeout=self.timeout)
 
         if r.status_code != 200:
             raise RuntimeError(f"request failed: {r.status_code}")
 
+        self.__cache_put(tag, name, comment)
+
     def delete(self, tag):
-        r = requests.delete(self.base_url + "/api/v1/member/" + tag.hex())
+        self.cache.pop(bytes(tag))
+        r = self.session.delete(self.base_url + "/api/v1/member/" + tag.hex(), timeout=self.timeout)
         if r.status_code != 204:
             raise RuntimeError(f"request failed: {r.status_code}")
 
     def insert(self, tag, name, comment):
         payload = { "fobId": tag.hex(), "name": name, "contactData": comment }
 
-        r = requests.post(self.base_url + "/api/v1/member", json=payload)
+        self.cache.pop(bytes(tag))
+        r = self.session.post(self.base_url + "/api/v1/member", json=payload, timeout=self.timeout)
 
         if r.status_code != 201:
             raise RuntimeError(f"request failed: {r.status_code}")
+
+        self.__cache_put(tag, name, comment)
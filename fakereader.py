@@ -8,6 +8,10 @@ class FakeTagReader(tk.Frame):
         super().__init__(parent)
         self.parent = parent
         self.nreads = 0
+        self.tag = None
+        # Button state is mirrored here, so that it can be read without
+        # touching Tk from the tag reader thread
+        self.buttons = 0
         self.create_widgets()
 
     def create_widgets(self):
@@ -20,11 +24,11 @@ class FakeTagReader(tk.Frame):
         row += 1
 
         self.left_var = tk.IntVar()
-        self.left_chk = tk.Checkbutton(self, var=self.left_var)
+        self.left_chk = tk.Checkbutton(self, var=self.left_var, command=self.update_buttons)
         self.left_chk.grid(column = 0, row = row, sticky='nsew')
 
         self.right_var = tk.IntVar()
-        self.right_chk = tk.Checkbutton(self, var=self.right_var)
+        self.right_chk = tk.Checkbutton(self, var=self.right_var, command=self.update_buttons)
         self.right_chk.grid(column = 1, row = row, sticky='nsew')
         row += 1
 
@@ -42,10 +46,13 @@ class FakeTagReader(tk.Frame):
             return self.tag
         return None
 
-    def read_buttons(self):
+    def update_buttons(self):
         buttons = 0
         if self.left_var.get():
             buttons += 1
         if self.right_var.get():
             buttons += 2
-        return buttons
+        self.buttons = buttons
+
+    def read_buttons(self):
+        return self.buttons
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import json
+import threading
+import time
+
+# A stand-in for the remote member database server, implementing the same
+# API as db_sett.Database uses, with the members kept in memory.
+# Can be run on its own, or started on a thread with FakeMemberServer.start()
+
+MEMBER_PATH = "/api/v1/member"
+
+class MemberHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def __reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length))
+
+    def __fob_id(self):
+        if not self.path.startswith(MEMBER_PATH + "/"):
+            return None
+        return self.path[len(MEMBER_PATH) + 1:]
+
+    def __handle(self, method):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+
+        if self.server.failures:
+            return self.__reply(self.server.failures.pop(0), {"error": "failure for testing"})
+
+        members = self.server.members
+        fob_id = self.__fob_id()
+
+        if method == "GET" and fob_id:
+            if fob_id not in members:
+                return self.__reply(404, {"error": "not found"})
+            return self.__reply(200, members[fob_id])
+        elif method == "PUT" and fob_id:
+            payload = self.__read_json()
+            if fob_id not in members:
+                return self.__reply(404, {"error": "not found"})
+            members[fob_id] = { "name": payload["name"], "contactData": payload["contactData"] }
+            return self.__reply(200, members[fob_id])
+        elif method == "DELETE" and fob_id:
+            if members.pop(fob_id, None) is None:
+                return self.__reply(404, {"error": "not found"})
+            return self.__reply(204)
+        elif method == "POST" and self.path == MEMBER_PATH:
+            payload = self.__read_json()
+            if payload["fobId"] in members:
+                return self.__reply(409, {"error": "exists"})
+            members[payload["fobId"]] = { "name": payload["name"], "contactData": payload["contactData"] }
+            return self.__reply(201, members[payload["fobId"]])
+
+        self.__reply(404, {"error": "bad request"})
+
+    def do_GET(self):
+        self.__handle("GET")
+
+    def do_PUT(self):
+        self.__handle("PUT")
+
+    def do_DELETE(self):
+        self.__handle("DELETE")
+
+    def do_POST(self):
+        self.__handle("POST")
+
+class FakeMemberServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # port=0 picks a free port, see base_url
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, verbose=False):
+        super().__init__((host, port), MemberHandler)
+        # fobId (hex) -> { "name": ..., "contactData": ... }
+        self.members = {}
+        self.delay = delay
+        self.verbose = verbose
+        self.requests = 0
+        # Statuses (e.g. 503) to reply to the next requests with, in order
+        self.failures = []
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        # A short poll interval, so stop() is quick
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(
+                        prog='fakeserver',
+                        description='Stand-in member database server')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8080)
+    parser.add_argument('--delay', help='Delay before each response (seconds)', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeMemberServer(port=args.port, delay=args.delay, verbose=True)
+    print(f"Serving on {server.base_url}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
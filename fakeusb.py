@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import array
+import collections
+
+import usb.core
+
+# Stand-in for a pyusb endpoint, so the printer drivers can be driven without
+# any hardware attached, e.g.:
+#
+#   printer = PrinterDymo450(endpoints=fake_endpoints())
+#
+# Writes are counted (and optionally recorded), reads return queued responses,
+# or the default response once the queue is empty (e.g. a printer status, for
+# a status monitor to poll).
+class FakeEndpoint():
+    def __init__(self, wMaxPacketSize=64, record=False):
+        self.wMaxPacketSize = wMaxPacketSize
+        self.record = record
+        self.data = bytearray()
+        self.responses = collections.deque()
+        self.default_response = None
+
+        self.transfers = 0
+        self.bytes_written = 0
+
+    def write(self, data, timeout=None):
+        self.transfers += 1
+        self.bytes_written += len(data)
+        if self.record:
+            self.data += data
+        return len(data)
+
+    def queue_response(self, data):
+        self.responses.append(bytes(data))
+
+    def set_default_response(self, data):
+        self.default_response = None if data is None else bytes(data)
+
+    def read(self, size, timeout=None):
+        if self.responses:
+            response = self.responses.popleft()
+        elif self.default_response is not None:
+            response = self.default_response
+        else:
+            raise usb.core.USBTimeoutError("FakeEndpoint: no response queued")
+
+        return array.array('B', response[:size])
+
+    def reset_counters(self):
+        self.transfers = 0
+        self.bytes_written = 0
+        self.data = bytearray()
+
+# (OUT, IN) pair to pass as a driver's 'endpoints'
+def fake_endpoints(record=False):
+    return (FakeEndpoint(record=record), FakeEndpoint())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+from array import array
+import math
+import operator
+import threading
+
+from PIL import ImageFont
+
+from cache import LRUCache, DEFAULT_FONT_CACHE_SIZE
+
+# Process-wide cache of loaded fonts, keyed by (font file, size).
+# Each FreeType face holds the font file open, so this must stay bounded -
+# an unbounded cache eventually makes font loading fail.
+font_cache = LRUCache(DEFAULT_FONT_CACHE_SIZE)
+
+def load_font(font, size):
+    return font_cache.get_or_load((font, size),
+                                  lambda: ImageFont.truetype(font=font, size=size))
+
+# Size (in pixels) the metrics tables are measured at
+METRICS_SIZE = 1000
+
+# Characters which get table entries, rather than being looked up in a dict
+METRICS_CHARS = 128
+
+# Advance widths and kerning for a font, for estimating text widths without
+# laying the text out with FreeType.
+#
+# Text width scales (almost) linearly with font size, so the tables are
+# measured once at METRICS_SIZE and scaled. At the real size hinting rounds
+# each glyph's advance, so the estimate can be out by up to about half a
+# pixel per character.
+#
+# Advances for ASCII are measured up front. Kerning pairs are only measured
+# the first time they're seen (most are zero, and measuring all of them is
+# slow), and anything outside ASCII is kept in dicts.
+class FontMetrics():
+    def __init__(self, path):
+        self.path = path
+        self.size = METRICS_SIZE
+        self.font = ImageFont.truetype(font=path, size=METRICS_SIZE)
+
+        self.advances = array('f', (self.font.getlength(chr(c)) for c in range(METRICS_CHARS)))
+        # NaN means not measured yet
+        self.kerning = array('f', [math.nan]) * (METRICS_CHARS * METRICS_CHARS)
+
+        self.other_advances = {}
+        self.other_kerning = {}
+
+    def __advance(self, c):
+        o = ord(c)
+        if o < METRICS_CHARS:
+            return self.advances[o]
+
+        adv = self.other_advances.get(c)
+        if adv is None:
+            adv = self.font.getlength(c)
+            self.other_advances[c] = adv
+        return adv
+
+    def __kerning(self, a, b):
+        oa, ob = ord(a), ord(b)
+        if oa < METRICS_CHARS and ob < METRICS_CHARS:
+            idx = (oa * METRICS_CHARS) + ob
+            kern = self.kerning[idx]
+            if math.isnan(kern):
+                kern = self.font.getlength(a + b) - self.advances[oa] - self.advances[ob]
+                self.kerning[idx] = kern
+            return kern
+
+        kern = self.other_kerning.get(a + b)
+        if kern is None:
+            kern = self.font.getlength(a + b) - self.__advance(a) - self.__advance(b)
+            self.other_kerning[a + b] = kern
+        return kern
+
+    # Width of 'text' at METRICS_SIZE. Scale by size / METRICS_SIZE for the
+    # width at another size.
+    def width(self, text):
+        if text.isascii():
+            data = text.encode('ascii')
+            width = sum(map(self.advances.__getitem__, data))
+
+            # Summing the kerning table entries for each pair of characters
+            # gives NaN if any of them haven't been measured yet
+            pairs = list(map(operator.add, map(METRICS_CHARS.__mul__, data), data[1:]))
+            kerning = sum(map(self.kerning.__getitem__, pairs))
+            if math.isnan(kerning):
+                for a, b in zip(text, text[1:]):
+                    self.__kerning(a, b)
+                kerning = sum(map(self.kerning.__getitem__, pairs))
+
+            return width + kerning
+
+        width = sum(self.__advance(c) for c in text)
+        for a, b in zip(text, text[1:]):
+            width += self.__kerning(a, b)
+        return width
+
+font_metrics = LRUCache(16)
+
+def load_metrics(path):
+    return font_metrics.get_or_load(path, lambda: FontMetrics(path))
+
+# Font families, each a list of font files to try in order
+DEFAULT_FAMILIES = {
+    "sans": ["Arial.ttf", "DejaVuSans.ttf"],
+}
+DEFAULT_FAMILY = "sans"
+
+# Maps font family names to font files.
+#
+# Finding a font file can mean searching the system font directories, so
+# each family is resolved to a full path once (ideally at startup, with
+# resolve_all()), and after that it's just a lookup.
+class FontRegistry():
+    def __init__(self, families=DEFAULT_FAMILIES):
+        self.families = {name: list(files) for name, files in families.items()}
+        self.paths = {}
+        self.lock = threading.Lock()
+
+    def set_family(self, family, files):
+        with self.lock:
+            self.families[family] = list(files)
+            self.paths.pop(family, None)
+
+    # The full path of the font file for a family
+    def path(self, family=DEFAULT_FAMILY):
+        path = self.paths.get(family)
+        if path is not None:
+            return path
+
+        with self.lock:
+            if family not in self.families:
+                raise ValueError(f"unknown font family '{family}'")
+
+            for i, filename in enumerate(self.families[family]):
+                try:
+                    # Let Pillow search for it, and remember where it was
+                    path = ImageFont.truetype(font=filename, size=10).path
+                except OSError:
+                    continue
+
+                if i > 0:
+                    print(f"Using backup font {filename} for '{family}'")
+                self.paths[family] = path
+                return path
+
+        raise ValueError(f"no font found for '{family}', tried: {', '.join(self.families[family])}")
+
+    def resolve_all(self):
+        for family in list(self.families):
+            self.path(family)
+
+    def font(self, family, size):
+        return load_font(self.path(family), size)
+
+registry = FontRegistry()
@@ -3,9 +3,79 @@
 from dataclasses import dataclass
 
 from PIL import Image
-from PIL import ImageFont
 from PIL import ImageDraw
 
+from cache import LRUCache, DEFAULT_IMAGE_CACHE_BYTES
+from fonts import load_font, load_metrics, registry, DEFAULT_FAMILY, METRICS_SIZE
+from layout import Layout, LineLayout, TextLayout, mm_to_px, px_to_mm, mm_to_px_round
+from stats import stats
+
+DEFAULT_LAYOUT_CACHE_SIZE = 256
+
+# Pillow stores mode '1' images with a byte per pixel, same as 'L'
+def image_nbytes(img):
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    return img.width * img.height * bytes_per_pixel
+
+# Process-wide cache of rendered label images, keyed by (layout, dpi).
+# Its size is counted in bytes.
+# The cached images are shared, so must not be modified.
+image_cache = LRUCache(DEFAULT_IMAGE_CACHE_BYTES, sizeof=image_nbytes)
+
+# Process-wide cache of label layouts, keyed by everything which affects the
+# layout
+layout_cache = LRUCache(DEFAULT_LAYOUT_CACHE_SIZE)
+
+# Draw a layout at any resolution.
+# Font sizes and positions are scaled from the layout, so at a dpi other than
+# the one it was made for, text widths can be a pixel or so out.
+def rasterize(layout, dpi):
+    key = (layout, dpi)
+    img = image_cache.get(key)
+    if img is not None:
+        return img
+
+    res = [mm_to_px(s, dpi) for s in layout.size_mm]
+
+    # Monochrome, 1 byte-per-pixel, fill with white
+    img = Image.new('1', res, 1)
+
+    d = ImageDraw.Draw(img)
+
+    for line in layout.lines:
+        font = load_font(line.font, mm_to_px_round(line.size_mm, dpi))
+        for text in line.texts:
+            pos = (mm_to_px_round(text.x_mm, dpi), mm_to_px_round(text.y_mm, dpi))
+            d.text(pos, text.text, font=font, fill=0, anchor='mt')
+
+    image_cache.put(key, img)
+
+    return img
+
+# Remembers how each line of a label was fitted, so that after an edit only
+# the lines which changed (or whose height budget changed) are fitted again.
+#
+# Meant to be owned by whatever's being edited (e.g. a preview), and only
+# used from one thread. Only the lines of the most recent layout are kept,
+# so lines which are deleted are dropped.
+class LineFitCache():
+    def __init__(self):
+        self.fits = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        lp = self.fits.get(key)
+        if lp is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return lp
+
+    # Replace the cache contents with the lines used by a layout
+    def replace(self, fits):
+        self.fits = fits
+
 class Label:
     @dataclass(frozen=True)
     class Padding:
@@ -36,12 +106,20 @@ class Label:
     ]
 
     def __mm_to_px(self, mm):
-        return int((mm / 25.4) * self.dpi)
+        return mm_to_px(mm, self.dpi)
 
-    def __init__(self, lines, dpi=300, size_mm=(89, 36), padding_mm=Padding(0, 0, 0, 0)):
+    def __px_to_mm(self, px):
+        return px_to_mm(px, self.dpi)
+
+    # 'font' is a font family name from the font registry
+    # 'fit_cache' is an optional LineFitCache
+    def __init__(self, lines, dpi=300, size_mm=(89, 36), padding_mm=Padding(0, 0, 0, 0), font=DEFAULT_FAMILY,
+                 fit_cache=None):
         self.dpi = dpi
+        self.fit_cache = fit_cache
+        self.size_mm = tuple(size_mm)
         self.res = [self.__mm_to_px(s) for s in size_mm]
-        self.img = None
+        self.lo = None
         self.padding = Label.Padding(
             left=self.__mm_to_px(padding_mm.left),
             top=self.__mm_to_px(padding_mm.top),
@@ -62,6 +140,17 @@ class Label:
                 lines_copy.append(line)
         self.lines = lines_copy
 
+        # Already resolved by the registry, so no font I/O here
+        self.font_path = registry.path(font)
+
+        self.key = (
+            tuple(tuple(line) for line in self.lines),
+            dpi,
+            tuple(size_mm),
+            padding_mm,
+            self.font_path,
+        )
+
         # Assign the appropriate maximum line percentages
         if len(self.lines) <= len(Label.__line_portions):
             portions = Label.__line_portions[len(self.lines)-1]
@@ -70,12 +159,54 @@ class Label:
             max_height = int(0.9 / len(self.lines) * self.usable_res[1])
             self.max_line_heights = [int(max_height)]  * len(self.lines)
 
-        size = self.max_line_heights[0]
-        try:
-            self.base_font = ImageFont.truetype(font="Arial.ttf", size=size)
-        except OSError:
-            print("Trying backup font for label creation")
-            self.base_font = ImageFont.truetype(font="DejaVuSans.ttf", size=size)
+    class LineMeasurement:
+        def __init__(self, line, size, font, boxes, total_gap_width, max_elem_width):
+            self.line = line
+            self.size = size
+            self.font = font
+            self.boxes = boxes
+            self.total_gap_width = total_gap_width
+            self.widths = [b[2] - b[0] for b in boxes]
+            self.ok = max(self.widths) <= max_elem_width
+
+    # Measure every element of a line at a particular font size
+    def __measure_line(self, line, size):
+        font = load_font(self.font_path, size)
+
+        total_gap_width = 0
+        if len(line) > 1:
+            # left, top, right, bottom
+            gap_bbox = font.getbbox('  ')
+            total_gap_width = (gap_bbox[2] - gap_bbox[0]) * (len(line) - 1)
+
+        max_elem_width = (self.usable_res[0] - total_gap_width) // len(line)
+
+        # Get the bounding box for each element, anchored in the centre
+        boxes = [font.getbbox(elem, anchor='mm') for elem in line]
+
+        return Label.LineMeasurement(line, size, font, boxes, total_gap_width, max_elem_width)
+
+    # Predict whether the line fits at 'size', from its width in the font's
+    # metrics tables (see FontMetrics), 'widths' for each element and 'gap'
+    # for the gap between them.
+    # Returns None if it's too close to call.
+    def __predict_fit(self, line, widths, gap, size):
+        scale = size / METRICS_SIZE
+        nelems = len(line)
+        max_elem_width = (self.usable_res[0] - (gap * scale * (nelems - 1))) / nelems
+
+        ok = True
+        for elem, width in zip(line, widths):
+            width *= scale
+            # Hinting rounds glyph advances to whole pixels, so the error
+            # grows with the number of characters as well as with the width.
+            tolerance = 2 + (0.5 * len(elem)) + (0.01 * width) + nelems
+            if width > max_elem_width + tolerance:
+                return False
+            elif width > max_elem_width - tolerance:
+                ok = None
+
+        return ok
 
     # Work out the appropriate font size for the line, based on the allowable
     # max_line_height, and the width of the image
@@ -83,35 +214,27 @@ class Label:
         size = self.max_line_heights[idx]
         line = self.lines[idx]
 
-        max_elem_width = self.usable_res[0] // len(line)
+        metrics = load_metrics(self.font_path)
+        widths = [metrics.width(elem) for elem in line]
+        gap = metrics.width('  ') if len(line) > 1 else 0
+
+        # Binary search to find the maximum allowable size that fits.
+        # Most steps are decided by scaling the widths from the metrics
+        # tables. Only sizes which are too close to call get measured with
+        # FreeType (along with the final size), so the result is the same as
+        # measuring every step.
+        measurements = {}
 
-        # Binary search to find the maximum allowable size that fits
         max_font_size = size
         min_font_size = 1
         while True:
-            # FIXME: There used to be a font cache, but it grew too large
-            # and then font loading would fail. I thought "font_variant" would
-            # fix that, but it doesn't.
-            font = self.base_font.font_variant(size=size)
-
-            total_gap_width = 0
-            if len(line) > 1:
-                # left, top, right, bottom
-                gap_bbox = font.getbbox('  ')
-                total_gap_width = (gap_bbox[2] - gap_bbox[0]) * (len(line) - 1)
-
-            max_elem_width = (self.usable_res[0] - total_gap_width) // len(line)
-
-            ok = True
-            boxes = []
-            # Get the bounding box for each element, anchored in the centre
-            # If any element is too big, bail out early
-            for elem in line:
-                bbox = font.getbbox(elem, anchor='mm')
-                if (bbox[2] - bbox[0]) > max_elem_width:
-                    ok = False
-                    break
-                boxes.append(bbox)
+            if size in measurements:
+                ok = measurements[size].ok
+            else:
+                ok = self.__predict_fit(line, widths, gap, size)
+                if ok is None:
+                    measurements[size] = self.__measure_line(line, size)
+                    ok = measurements[size].ok
 
             if ok:
                 min_font_size = size
@@ -121,31 +244,55 @@ class Label:
             new_size = min_font_size + ((max_font_size - min_font_size) // 2)
 
             if new_size == size:
-                return Label.LabelLine(font, line, boxes)
-            else:
-                del font
+                if size not in measurements:
+                    measurements[size] = self.__measure_line(line, size)
+                m = measurements[size]
+                return Label.LabelLine(m.font, line, m.boxes)
 
             size = new_size
 
             if size == 0:
                 raise ValueError(f"couldn't fit {line}")
 
-    def image(self):
-        if self.img:
-            return self.img
+    # Work out the font sizes and positions for the label at this Label's dpi
+    def layout(self):
+        if self.lo:
+            return self.lo
+
+        lo = layout_cache.get(self.key)
+        if lo is None:
+            lo = self.__layout()
+            layout_cache.put(self.key, lo)
 
-        # Monochrome, 1 byte-per-pixel, fill with white
-        img = Image.new('1', self.res, 1)
+        self.lo = lo
 
-        d = ImageDraw.Draw(img)
+        return lo
 
+    # Render the label at this Label's dpi
+    def image(self):
+        with stats.timer("render"):
+            return rasterize(self.layout(), self.dpi)
+
+    def __layout(self):
         # Work out the sizes for each line
         line_params = []
+        fits = {}
         for i, line in enumerate(self.lines):
-            lp = self.__choose_line_size(i)
+            # Everything __choose_line_size() depends on
+            key = (tuple(line), self.max_line_heights[i], self.usable_res[0], self.font_path)
+
+            lp = fits.get(key)
+            if lp is None and self.fit_cache is not None:
+                lp = self.fit_cache.get(key)
+            if lp is None:
+                lp = self.__choose_line_size(i)
+            fits[key] = lp
 
             line_params.append(lp)
 
+        if self.fit_cache is not None:
+            self.fit_cache.replace(fits)
+
         # Distribute the lines with an equal gap between them
         total_height = sum([lp.height for lp in line_params])
         spare_height = self.usable_res[1] - total_height
@@ -153,6 +300,7 @@ class Label:
 
         # Top and bottom gap is half the gap between lines
         line_top = (line_gap // 2) + self.padding.top
+        lines = []
         for i, lp in enumerate(line_params):
             # Columns get distributed evenly among all elements
             # TODO: Is this really ideal? If the elements are very different
@@ -160,12 +308,15 @@ class Label:
             col_width = self.usable_res[0] // len(lp.line)
 
             x = (col_width // 2) + self.padding.left
+            texts = []
             for j, elem in enumerate(lp.line):
-                d.text((x, line_top), elem, font=lp.font, fill=0, anchor='mt')
+                box = tuple(self.__px_to_mm(v) for v in lp.boxes[j])
+                texts.append(TextLayout(elem, self.__px_to_mm(x), self.__px_to_mm(line_top), box))
                 x += col_width
 
-            line_top += lp.height + line_gap
+            lines.append(LineLayout(lp.font.path, self.__px_to_mm(lp.font.size),
+                                    self.__px_to_mm(lp.height), tuple(texts)))
 
-        self.img = img
+            line_top += lp.height + line_gap
 
-        return img
+        return Layout(self.size_mm, tuple(lines))
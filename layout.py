@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass
+
+# A laid out label, independent of resolution.
+#
+# Everything is in millimetres, so a layout worked out once (which is the
+# expensive part, because of the font fitting) can be drawn at any dpi. See
+# Label.layout() for making one, and label.rasterize() for drawing it.
+#
+# Layouts are immutable and hashable, so they can be used as cache keys, and
+# to_dict()/from_dict() convert to and from plain types for JSON.
+
+def mm_to_px(mm, dpi):
+    return int((mm / 25.4) * dpi)
+
+def px_to_mm(px, dpi):
+    return (px * 25.4) / dpi
+
+# Positions are rounded (rather than truncated) back to pixels, so that a
+# layout made at some dpi draws exactly the same at that dpi
+def mm_to_px_round(mm, dpi):
+    return round((mm / 25.4) * dpi)
+
+@dataclass(frozen=True)
+class TextLayout:
+    text: str
+    # Position of the middle-top of the text (Pillow's 'mt' anchor)
+    x_mm: float
+    y_mm: float
+    # Bounding box (left, top, right, bottom), relative to the middle-middle
+    # of the text
+    box_mm: tuple
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "x_mm": self.x_mm,
+            "y_mm": self.y_mm,
+            "box_mm": list(self.box_mm),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["text"], d["x_mm"], d["y_mm"], tuple(d["box_mm"]))
+
+@dataclass(frozen=True)
+class LineLayout:
+    # Font file, as passed to ImageFont.truetype()
+    font: str
+    size_mm: float
+    height_mm: float
+    texts: tuple
+
+    def to_dict(self):
+        return {
+            "font": self.font,
+            "size_mm": self.size_mm,
+            "height_mm": self.height_mm,
+            "texts": [t.to_dict() for t in self.texts],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        texts = tuple(TextLayout.from_dict(t) for t in d["texts"])
+        return cls(d["font"], d["size_mm"], d["height_mm"], texts)
+
+@dataclass(frozen=True)
+class Layout:
+    size_mm: tuple
+    lines: tuple
+
+    def to_dict(self):
+        return {
+            "size_mm": list(self.size_mm),
+            "lines": [l.to_dict() for l in self.lines],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        lines = tuple(LineLayout.from_dict(l) for l in d["lines"])
+        return cls(tuple(d["size_mm"]), lines)
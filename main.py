@@ -1,21 +1,39 @@
 #!/usr/bin/env python3
 
-from db import Database
-from db_sett import Database as RemoteDatabase
-from label import Label
-from tagreader import TagReader
-from fakereader import FakeTagReader
-from printer import DisplayPrinter, RotatePrinter
-from printer_d450 import PrinterDymo450
-from printer_tspl import PrinterVretti420B
-from app_ui import BadgerApp
-from sound import SoundThread
 import argparse
 import datetime
+import json
+import os
 import time
-import tkinter as tk
-import multiprocessing
-from tkinter import ttk
+
+# Everything else is imported by the sub-command which needs it, so that e.g.
+# "lookup" doesn't pay for importing Tk, Pillow, pyusb and requests.
+
+def printer_class(name):
+    if name == 'd450':
+        from printer_d450 import PrinterDymo450
+        return PrinterDymo450
+    elif name == 'vretti':
+        from printer_tspl import PrinterVretti420B
+        return PrinterVretti420B
+
+    raise ValueError("No printer?")
+
+def setup_fonts(args):
+    from fonts import registry
+
+    for spec in args.font or []:
+        family, _, files = spec.partition('=')
+        if not files:
+            raise ValueError(f"--font should be FAMILY=FILE[,FILE...], not '{spec}'")
+        registry.set_family(family, files.split(','))
+
+    # Find all the font files now, rather than on the first label
+    registry.resolve_all()
+
+def setup_stats(args):
+    from stats import stats, DEFAULT_STATS_DIR
+    stats.enable(args.stats_dir or DEFAULT_STATS_DIR)
 
 def open_db(args):
     db_path = args.database
@@ -24,12 +42,15 @@ def open_db(args):
         if args.init:
             raise RuntimeError("Init not supported with remote database server")
 
+        from db_sett import Database as RemoteDatabase
         return RemoteDatabase(db_path)
     else:
+        from db import Database
+
         if not args.init:
             # Check if the DB file exists
             try:
-                db = Database(f'file:{args.database}?mode=ro')
+                db = Database(args.database, readonly=True)
                 db.close()
             except Exception as e:
                 raise
@@ -65,10 +86,12 @@ def lookup(args):
     print(f'Lookup tag:{tag.hex()}, name:{name}, contact:{contact}')
 
 def reader(args):
+    from tagreader import TagReader
     tagreader = TagReader(args.port)
 
     db = None
     if args.database:
+        from db import Database
         db = Database(args.database)
 
     now = datetime.datetime.now()
@@ -93,64 +116,207 @@ def reader(args):
             break
 
 def label(args):
-    lbl = Label(args.lines, args.dpi, (args.width_mm, args.height_mm))
+    from label import Label, rasterize
+    from layout import Layout
+
+    setup_fonts(args)
+
+    if args.layout_in:
+        with open(args.layout_in) as f:
+            layout = Layout.from_dict(json.load(f))
+    else:
+        layout = Label(args.lines, args.dpi, (args.width_mm, args.height_mm)).layout()
 
-    img = lbl.image()
+    if args.layout_out:
+        with open(args.layout_out, 'w') as f:
+            json.dump(layout.to_dict(), f, indent=2)
+
+    img = rasterize(layout, args.dpi)
     if args.out is None:
         img.show()
     else:
         img.save(args.out)
 
-def run_ui(args):
-    root = tk.Tk()
+def batch(args):
+    from batch import read_rows, run_batch
 
-    if args.database:
-        db = open_db(args)
+    setup_fonts(args)
+    setup_stats(args)
+
+    rows = read_rows(args.file, args.format)
+    db = open_db(args) if args.database else None
+
+    if args.dry_run:
+        from fakeusb import fake_endpoints
+        endpoints = fake_endpoints()
+        printer = printer_class(args.printer)(endpoints=endpoints)
     else:
-        db = None
+        printer = printer_class(args.printer)()
+
+    total = max(len(rows) - args.start_row + 1, 0)
+    print(f"Printing {total} labels from {args.file}")
 
+    start = time.monotonic()
+    done = 0
+    skipped = 0
+    try:
+        # Rotated the same way as in the UI
+        for n, error in run_batch(rows, printer, db, start_row=args.start_row,
+                                  size_mm=(args.width_mm, args.height_mm), rotate=90,
+                                  skip_errors=args.skip_errors, workers=args.workers):
+            done += 1
+            rate = done / (time.monotonic() - start)
+            if error:
+                skipped += 1
+                print(f"[{done}/{total}] row {n}: skipped: {error}")
+            else:
+                print(f"[{done}/{total}] row {n}: printed ({rate:.1f} labels/s)")
+    finally:
+        printer.close()
+
+    print(f"Printed {done - skipped} labels, skipped {skipped}, in {time.monotonic() - start:.1f} s")
+    if args.dry_run:
+        ep_out = endpoints[0]
+        print(f"Would have sent {ep_out.bytes_written} bytes in {ep_out.transfers} transfers")
+
+def serve(args):
+    from server import LabelServer, UnixLabelServer
+
+    setup_fonts(args)
+    setup_stats(args)
+
+    printer = None
+    if args.printer:
+        from spooler import PrintSpooler
+        printer = PrintSpooler(printer_class(args.printer))
+
+    if args.socket:
+        server = UnixLabelServer(args.socket, printer, workers=args.workers, verbose=args.verbose)
+        print(f"Serving on {args.socket}")
+    else:
+        server = LabelServer((args.host, args.port), printer, workers=args.workers, verbose=args.verbose)
+        print(f"Serving on http://{args.host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if printer:
+            printer.close()
+
+def show_stats(args):
+    import stats
+
+    dirname = args.stats_dir or stats.DEFAULT_STATS_DIR
+    if args.reset:
+        stats.reset(dirname)
+        print(f"Cleared stats in {dirname}")
+        return
+
+    histograms = stats.load(dirname)
+    if args.prometheus:
+        text = stats.prometheus(histograms)
+        if args.prometheus == '-':
+            print(text, end='')
+        else:
+            # Written in one go, for node_exporter's textfile collector
+            tmp = args.prometheus + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(text)
+            os.replace(tmp, args.prometheus)
+        return
+
+    if not histograms:
+        print(f"No stats in {dirname}")
+        return
+    print(stats.summary(histograms))
+
+def run_ui(args):
+    from fonts import font_cache
+    from label import image_cache
+    from printer import DisplayPrinter, RotatePrinter
+
+    font_cache.resize(args.font_cache_size)
+    image_cache.resize(args.label_cache_mb * 1024 * 1024)
+    setup_fonts(args)
+    setup_stats(args)
+
+    # Start the print spooler before Tk, so its process doesn't inherit
+    # any Tk state
     if args.printer == 'display':
         printer = DisplayPrinter()
     elif args.printer == 'display_r90':
         printer = RotatePrinter(DisplayPrinter())
-    elif args.printer == 'd450':
-        printer = RotatePrinter(PrinterDymo450())
-    elif args.printer == 'vretti':
-        printer = RotatePrinter(PrinterVretti420B())
     else:
-        raise ValueError("No printer?")
+        from spooler import PrintSpooler
+        printer = RotatePrinter(PrintSpooler(printer_class(args.printer)))
+
+    import tkinter as tk
+    from app_ui import BadgerApp
+
+    root = tk.Tk()
+
+    if args.database:
+        db = open_db(args)
+    else:
+        db = None
 
     if args.port == "fake":
+        from fakereader import FakeTagReader
         reader_window = tk.Toplevel(root)
         tagreader = FakeTagReader(reader_window)
     else:
         try:
+            from tagreader import TagReader
             tagreader = TagReader(args.port)
         except:
             tagreader = None
             print("Couldn't open tag reader (did you specify the correct --port?)")
 
-    if args.sound:
-        queue = multiprocessing.Queue()
-        sound = SoundThread(queue)
-        soundproc = multiprocessing.Process(target=sound.run)
-        soundproc.start()
-    else:
-        sound = None
+    sound = None
+    if args.sound or args.sound_out:
+        from sound import SoundEngine, AplaySink, FileSink
+        try:
+            if args.sound_out:
+                sound = SoundEngine(FileSink, (args.sound_out,))
+            else:
+                sound = SoundEngine(AplaySink, (args.sound_device,))
+            sound.start()
+        except Exception as e:
+            sound = None
+            print(f"Couldn't start sound: {e}")
 
     root.resizable(False,False)
     app = BadgerApp(root, printer=printer, tagreader=tagreader, db=db, sound=sound)
     app.mainloop()
-    sound.stop()
-    soundproc.join()
+    printer.close()
+    if sound:
+        sound.stop()
+        latency = sound.latency_ms()
+        if latency:
+            print("Scan to beep latency: min {:.1f} ms, median {:.1f} ms, max {:.1f} ms".format(*latency))
 
 def main():
+    # Only for the --help defaults, cache doesn't import anything heavy
+    from cache import DEFAULT_FONT_CACHE_SIZE, DEFAULT_IMAGE_CACHE_BYTES
+
     parser = argparse.ArgumentParser(
                         prog='badger-ng',
                         description='Makespace Badger')
 
     subparsers = parser.add_subparsers(title="Sub-commands")
 
+    # Common arguments for commands which render labels
+    font_cmd_parser = argparse.ArgumentParser(description="parent parser for label commands", add_help = False)
+    font_cmd_parser.add_argument('--font', help='Font files to use for a font family, in order of preference, '
+                                                'e.g. sans=Arial.ttf,DejaVuSans.ttf (repeatable)', action='append')
+
+    # Common arguments for commands which record stage timings
+    stats_cmd_parser = argparse.ArgumentParser(description="parent parser for stats commands", add_help = False)
+    stats_cmd_parser.add_argument('--stats-dir', help='Directory for stage timings (default: ~/.cache/badger/stats)', default=None)
+
     # Command arguments for db commands
     db_cmd_parser = argparse.ArgumentParser(description="parent parser for db commands", add_help = False)
     db_cmd_parser.add_argument('--init', action='store_true')
@@ -182,15 +348,48 @@ def main():
     lookup_parser.set_defaults(func=lookup)
 
     label_parser = subparsers.add_parser('label', add_help=True,
+                                          parents=[font_cmd_parser],
                                           description='Generate a label image',
                                           help='Generate a label image')
     label_parser.add_argument('--dpi', help='Image DPI', type=int, default=300)
     label_parser.add_argument('--width_mm', help='Label width (mm)', type=int, default=89)
     label_parser.add_argument('--height_mm', help='Label height (mm)', type=int, default=36)
     label_parser.add_argument('--out', help='Output filename (default: preview)', default=None)
+    label_parser.add_argument('--layout-out', help='Also save the layout (JSON)', default=None)
+    label_parser.add_argument('--layout-in', help='Draw a saved layout instead of laying out lines', default=None)
     label_parser.add_argument('lines', help='Text lines to put on label', nargs='*')
     label_parser.set_defaults(func=label)
 
+    batch_parser = subparsers.add_parser('batch', add_help=True,
+                                          parents=[font_cmd_parser, stats_cmd_parser],
+                                          description='Print a label for each row of a CSV or JSONL file. '
+                                                      'Rows have a "tag" to look up, "name" and "comment", '
+                                                      'or (JSONL only) a list of "lines"',
+                                          help='Print labels from a file')
+    batch_parser.add_argument('--printer', help='Printer to use', choices=['d450', 'vretti'], required=True)
+    batch_parser.add_argument('-d', '--database', help='Database file or server URL, for rows with tags', default=None)
+    batch_parser.add_argument('--format', help='File format (default: from the extension)', choices=['csv', 'jsonl'], default=None)
+    batch_parser.add_argument('--start-row', help='First row to print (counting from 1, excluding the CSV header)', type=int, default=1)
+    batch_parser.add_argument('--skip-errors', help="Skip rows which can't be looked up or rendered", action='store_true')
+    batch_parser.add_argument('--workers', help='Number of rendering processes (default: one per CPU)', type=int, default=None)
+    batch_parser.add_argument('--width_mm', help='Label width (mm)', type=int, default=89)
+    batch_parser.add_argument('--height_mm', help='Label height (mm)', type=int, default=36)
+    batch_parser.add_argument('--dry-run', help="Render and encode everything, but don't send it to a printer", action='store_true')
+    batch_parser.add_argument('file', help='CSV or JSONL file')
+    batch_parser.set_defaults(func=batch, init=False)
+
+    serve_parser = subparsers.add_parser('serve', add_help=True,
+                                          parents=[font_cmd_parser, stats_cmd_parser],
+                                          description='Render and print labels for other programs, over HTTP',
+                                          help='Run a label rendering server')
+    serve_parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    serve_parser.add_argument('--port', help='Port to listen on', type=int, default=8090)
+    serve_parser.add_argument('--socket', help='Listen on this Unix socket instead', default=None)
+    serve_parser.add_argument('--printer', help='Printer to print on (default: render only)', choices=['d450', 'vretti'], default=None)
+    serve_parser.add_argument('--workers', help='Number of rendering processes (default: one per CPU)', type=int, default=None)
+    serve_parser.add_argument('-v', '--verbose', help='Log each request', action='store_true')
+    serve_parser.set_defaults(func=serve)
+
     reader_parser = subparsers.add_parser('reader', add_help=True,
                                           description='Read a tag',
                                           help='Read a tag')
@@ -201,15 +400,31 @@ def main():
     reader_parser.set_defaults(func=reader)
 
     ui_parser = subparsers.add_parser('ui', add_help=True,
+                                          parents=[font_cmd_parser, stats_cmd_parser],
                                           description='Run the badger UI',
                                           help='Run the badger UI')
     ui_parser.add_argument('--port', help='Serial port for the tag reader', default='/dev/ttyUSB0')
     ui_parser.add_argument('-d', '--database', help='Database file or server URL', default=None)
     ui_parser.add_argument('--init', help="Initialise the database", action='store_true')
-    ui_parser.add_argument('--sound', help="Run the sound thread", action='store_true')
+    ui_parser.add_argument('--sound', help="Beep when a tag is scanned", action='store_true')
+    ui_parser.add_argument('--sound-device', help="ALSA device for --sound (default: the default device)", default=None)
+    ui_parser.add_argument('--sound-out', help="Write the sound to this wav file instead of playing it", default=None)
     ui_parser.add_argument('--printer', help='Printer to use', choices=['display', 'display_r90', 'd450', 'vretti'], default='display')
+    ui_parser.add_argument('--font-cache-size', help='Maximum number of loaded fonts to keep (default: %(default)s)',
+                           type=int, default=DEFAULT_FONT_CACHE_SIZE)
+    ui_parser.add_argument('--label-cache-mb', help='Memory to use for caching rendered labels (MiB, default: %(default)s)',
+                           type=int, default=DEFAULT_IMAGE_CACHE_BYTES // (1024 * 1024))
     ui_parser.set_defaults(func=run_ui)
 
+    stats_parser = subparsers.add_parser('stats', add_help=True,
+                                          parents=[stats_cmd_parser],
+                                          description='Show how long each stage of printing a label has taken '
+                                                      '(recorded by ui, batch and serve)',
+                                          help='Show stage timings')
+    stats_parser.add_argument('--prometheus', help="Write them in Prometheus' text format to this file ('-' for stdout) instead", default=None)
+    stats_parser.add_argument('--reset', help='Clear the recorded timings', action='store_true')
+    stats_parser.set_defaults(func=show_stats)
+
     args = parser.parse_args()
 
     try:
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
 
-from PIL import Image
-
 class DisplayPrinter:
     def __init__(self):
         pass
 
-    def print_image(self, image, **kwargs):
+    def print_image(self, image, rotate=0, **kwargs):
+        if rotate:
+            image = image.rotate(rotate, expand=True)
         image.show()
 
+    # Printing is synchronous, so there's never any job status to report
+    def poll_status(self):
+        return []
+
+    def close(self):
+        pass
+
     @property
     def dpi(self):
         return 300
@@ -17,6 +24,9 @@ class DisplayPrinter:
     def padding(self):
         return (2, 0, 2, 0)
 
+# Rotates labels (counter-clockwise, by 'rot' degrees) for printers which
+# feed the label sideways. The rotation is applied by the printer while
+# encoding the image, rather than by making a rotated copy here.
 class RotatePrinter:
     def __init__(self, printer=None, rot=90):
         self.printer = printer
@@ -24,8 +34,13 @@ class RotatePrinter:
         pass
 
     def print_image(self, image, **kwargs):
-        image = image.transpose(Image.Transpose.ROTATE_90)
-        self.printer.print_image(image, **kwargs)
+        return self.printer.print_image(image, rotate=self.rot, **kwargs)
+
+    def poll_status(self):
+        return self.printer.poll_status()
+
+    def close(self):
+        self.printer.close()
 
     @property
     def dpi(self):
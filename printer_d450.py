@@ -1,40 +1,71 @@
 #!/usr/bin/env python3
 
+import threading
 import usb.core
 import usb.util
 
-import multiprocessing
+from printerstatus import READY, BUSY, PAPER_OUT, ERROR
+from raster import pack_image
+from stats import stats
+
+# Data is sent in transfers of this many full-size USB packets
+BULK_PACKETS = 64
+
+# The most lines one skip command (ESC f 1 n) can skip
+MAX_SKIP_LINES = 255
+
+# ESC A status byte bits.
+# Only top-of-form has been seen on a real printer (see main()), the others
+# are from the LabelWriter technical reference, and are untested.
+STATUS_BUSY = 0x01
+STATUS_TOP_OF_FORM = 0x02
+STATUS_PAPER_OUT = 0x20
+STATUS_ERROR = 0x40
 
 class PrinterDymo450():
-    def __init__(self):
-        dev = usb.core.find(idVendor=0x0922, idProduct=0x0020)
-        if dev is None:
-            raise ValueError('PrinterDymo450: device not found')
-        self.dev = dev
-        self.print_proc = None
-
-        if dev.is_kernel_driver_active(0):
-            dev.detach_kernel_driver(0)
-
-        dev.set_configuration()
-        cfg = dev.get_active_configuration()
-        intf = cfg[(0,0)]
-
-        self.ep_out = usb.util.find_descriptor(intf,
-            # match the first OUT endpoint
-            custom_match = \
-            lambda e: \
-                usb.util.endpoint_direction(e.bEndpointAddress) == \
-                usb.util.ENDPOINT_OUT)
-        self.ep_in = usb.util.find_descriptor(intf,
-            # match the first IN endpoint
-            custom_match = \
-            lambda e: \
-                usb.util.endpoint_direction(e.bEndpointAddress) == \
-                usb.util.ENDPOINT_IN)
+    # Scanline columns are MSB-first, with a set bit for a black dot
+    # Determined empricially.
+    ink = 1
+    # For stats
+    model = "d450"
+
+    def __init__(self, endpoints=None):
+        if endpoints:
+            # Already-open (or fake) (OUT, IN) endpoints
+            self.dev = None
+            self.ep_out, self.ep_in = endpoints
+        else:
+            dev = usb.core.find(idVendor=0x0922, idProduct=0x0020)
+            if dev is None:
+                raise ValueError('PrinterDymo450: device not found')
+            self.dev = dev
+
+            if dev.is_kernel_driver_active(0):
+                dev.detach_kernel_driver(0)
+
+            dev.set_configuration()
+            cfg = dev.get_active_configuration()
+            intf = cfg[(0,0)]
+
+            self.ep_out = usb.util.find_descriptor(intf,
+                # match the first OUT endpoint
+                custom_match = \
+                lambda e: \
+                    usb.util.endpoint_direction(e.bEndpointAddress) == \
+                    usb.util.ENDPOINT_OUT)
+            self.ep_in = usb.util.find_descriptor(intf,
+                # match the first IN endpoint
+                custom_match = \
+                lambda e: \
+                    usb.util.endpoint_direction(e.bEndpointAddress) == \
+                    usb.util.ENDPOINT_IN)
 
         assert (self.ep_out is not None) and (self.ep_in is not None)
 
+        # Held while printing or reading the status, so that a status read
+        # from another thread can't land in the middle of a job
+        self.io_lock = threading.Lock()
+
         self.reset()
 
     @property
@@ -49,7 +80,8 @@ class PrinterDymo450():
         return (3, 0, 5 + 3, 0)
 
     def close(self):
-        usb.util.dispose_resources(self.dev)
+        if self.dev:
+            usb.util.dispose_resources(self.dev)
         self.dev = None
 
     def sync(self):
@@ -59,19 +91,39 @@ class PrinterDymo450():
         self.sync()
         self.write_command(ord('@'))
 
+    def __command(self, cmd, args=[]):
+        return bytes([0x1b, cmd]) + bytes(args)
+
     def write_command(self, cmd, args=[]):
-        buf = bytes([0x1b, cmd]) + bytes(args)
-        self.ep_out.write(buf)
+        self.ep_out.write(self.__command(cmd, args))
 
     def write_data(self, data=[]):
         buf = bytes([0x16]) + bytes(data)
         self.ep_out.write(buf)
 
-    def get_status(self):
-        self.write_command(ord('A'))
+    # Write a buffer in transfers of BULK_PACKETS full-size packets
+    def __write_bulk(self, buf):
+        chunk = self.ep_out.wMaxPacketSize * BULK_PACKETS
+        for start in range(0, len(buf), chunk):
+            self.ep_out.write(buf[start:start + chunk])
 
-        status = self.ep_in.read(1)
-        return status[0]
+    def get_status(self):
+        with self.io_lock:
+            self.write_command(ord('A'))
+
+            status = self.ep_in.read(1)
+            return status[0]
+
+    # One of the printerstatus states
+    def status(self):
+        status = self.get_status()
+        if status & STATUS_PAPER_OUT:
+            return PAPER_OUT
+        elif status & STATUS_ERROR:
+            return ERROR
+        elif status & STATUS_BUSY:
+            return BUSY
+        return READY
 
     def get_version(self):
         self.write_command(ord('V'))
@@ -85,58 +137,58 @@ class PrinterDymo450():
     def short_form_feed(self):
         self.write_command(ord('G'))
 
-    def __print_image(self, width, height, image_data):
-        nbytes = (width + 7) // 8
-
-        packed_lines = []
-
-        for row in range(height):
-            line = []
-            for byte in range(nbytes):
-                b = 0
-                for bit in range(8):
-                    col = (byte * 8) + bit
-                    if col >= width:
-                        break
-
-                    idx = row * width + col
-                    v = image_data[idx]
-                    if v == 0:
-                        # Scanline columns are MSB-first
-                        # Determined empricially.
-                        b |= (1 << (7 - bit))
-                line.append(b)
-            packed_lines.append(line)
+    # Print an already-packed Raster (see print_image())
+    #
+    # The whole job is built up in one buffer and sent in a few large
+    # transfers, rather than a transfer per line. Runs of blank lines are
+    # sent as skip commands (ESC f 1 n) instead of line data.
+    def print_raster(self, raster):
+        with stats.timer("encode", self.model):
+            buf = self.__encode(raster)
 
-        self.sync()
-        self.write_command(ord('D'), [nbytes])
+        with self.io_lock, stats.timer("usb_write", self.model):
+            self.__write_bulk(buf)
+
+    def __encode(self, raster):
+        buf = bytearray()
+        buf += self.__command(0x1b, [0x1b] * 84)
+        buf += self.__command(ord('D'), [raster.stride])
 
-        nrows = len(packed_lines) + 100
+        nrows = raster.height + 100
         n1 = nrows // 256
         n2 = nrows % 256
-        self.write_command(ord('L'), [n1, n2])
-
-        for line in packed_lines:
-            self.write_data(line)
-
-        self.form_feed()
-
-    def print_image(self, image, thread=False):
-        # Always wait for any previous print job
-        if self.print_proc:
-            self.print_proc.join()
-            self.print_proc = None
-
-        width = image.width
-        height = image.height
-        image_data = image.getdata()
-
-        if thread:
-            self.print_proc = multiprocessing.Process(target=self.__print_image,
-                                                      args=(width, height, image_data))
-            self.print_proc.start()
-        else:
-            self.__print_image(width, height, image_data)
+        buf += self.__command(ord('L'), [n1, n2])
+
+        blank_row = bytes(raster.stride)
+        nblank = 0
+        for line in raster.rows():
+            if line == blank_row:
+                nblank += 1
+                continue
+
+            buf += self.__skip_lines(nblank)
+            nblank = 0
+
+            buf += b'\x16'
+            buf += line
+
+        buf += self.__skip_lines(nblank)
+        buf += self.__command(ord('E'))
+
+        return buf
+
+    def __skip_lines(self, n):
+        buf = bytearray()
+        while n > 0:
+            count = min(n, MAX_SKIP_LINES)
+            buf += self.__command(ord('f'), [ord('1'), count])
+            n -= count
+        return buf
+
+    def print_image(self, image, rotate=0):
+        with stats.timer("pack", self.model):
+            raster = pack_image(image, ink=self.ink, rotate=rotate)
+        self.print_raster(raster)
 
 def main():
     printer = PrinterDymo450()
@@ -1,41 +1,67 @@
 #!/usr/bin/env python3
 
 import io
+import threading
 import usb.core
 import usb.util
 
-import multiprocessing
+from printerstatus import READY, BUSY, PAPER_OUT, ERROR
+from raster import pack_image, ink_regions
+from stats import stats
+
+# <ESC>!? status byte bits
+STATUS_HEAD_OPEN = 0x01
+STATUS_PAPER_JAM = 0x02
+STATUS_PAPER_OUT = 0x04
+STATUS_RIBBON_OUT = 0x08
+STATUS_PAUSED = 0x10
+STATUS_PRINTING = 0x20
+STATUS_COVER_OPEN = 0x40
+STATUS_OTHER_ERROR = 0x80
 
 class PrinterTSPL():
-    def __init__(self, vid, pid):
-        dev = usb.core.find(idVendor=vid, idProduct=pid)
-        if dev is None:
-            raise ValueError('PrinterVretti420B: device not found')
-        self.dev = dev
-        self.print_proc = None
-
-        if dev.is_kernel_driver_active(0):
-            dev.detach_kernel_driver(0)
-
-        dev.set_configuration()
-        cfg = dev.get_active_configuration()
-        intf = cfg[(0,0)]
-
-        self.ep_out = usb.util.find_descriptor(intf,
-            # match the first OUT endpoint
-            custom_match = \
-            lambda e: \
-                usb.util.endpoint_direction(e.bEndpointAddress) == \
-                usb.util.ENDPOINT_OUT)
-        self.ep_in = usb.util.find_descriptor(intf,
-            # match the first IN endpoint
-            custom_match = \
-            lambda e: \
-                usb.util.endpoint_direction(e.bEndpointAddress) == \
-                usb.util.ENDPOINT_IN)
+    # A cleared bit prints a black dot
+    ink = 0
+    # For stats
+    model = "tspl"
+
+    def __init__(self, vid, pid, endpoints=None):
+        if endpoints:
+            # Already-open (or fake) (OUT, IN) endpoints
+            self.dev = None
+            self.ep_out, self.ep_in = endpoints
+        else:
+            dev = usb.core.find(idVendor=vid, idProduct=pid)
+            if dev is None:
+                raise ValueError('PrinterVretti420B: device not found')
+            self.dev = dev
+
+            if dev.is_kernel_driver_active(0):
+                dev.detach_kernel_driver(0)
+
+            dev.set_configuration()
+            cfg = dev.get_active_configuration()
+            intf = cfg[(0,0)]
+
+            self.ep_out = usb.util.find_descriptor(intf,
+                # match the first OUT endpoint
+                custom_match = \
+                lambda e: \
+                    usb.util.endpoint_direction(e.bEndpointAddress) == \
+                    usb.util.ENDPOINT_OUT)
+            self.ep_in = usb.util.find_descriptor(intf,
+                # match the first IN endpoint
+                custom_match = \
+                lambda e: \
+                    usb.util.endpoint_direction(e.bEndpointAddress) == \
+                    usb.util.ENDPOINT_IN)
 
         assert (self.ep_out is not None) and (self.ep_in is not None)
 
+        # Held while printing or reading the status, so that a status read
+        # from another thread can't land in the middle of a job
+        self.io_lock = threading.Lock()
+
     @property
     def dpi(self):
         return 203
@@ -63,64 +89,62 @@ class PrinterTSPL():
         dots = int(distance_mm * 8)
         self.write_command(f"BACKUP {dots}")
 
+    # Immediate status (<ESC>!?), answered even while printing
+    def get_status(self):
+        with self.io_lock:
+            self.ep_out.write(b"\x1b!?")
+
+            status = self.ep_in.read(1)
+            return status[0]
+
+    # One of the printerstatus states
+    def status(self):
+        status = self.get_status()
+        if status & STATUS_PAPER_OUT:
+            return PAPER_OUT
+        elif status & ~(STATUS_PAUSED | STATUS_PRINTING):
+            return ERROR
+        elif status:
+            return BUSY
+        return READY
+
     def close(self):
-        usb.util.dispose_resources(self.dev)
+        if self.dev:
+            usb.util.dispose_resources(self.dev)
         self.dev = None
 
-    def __print_image(self, width, height, image_data):
-        nbytes = (width + 7) // 8
-
+    # Print an already-packed Raster (see print_image())
+    def print_raster(self, raster):
         buf = io.BytesIO()
 
-        # TODO: I don't know why x offset of 70 is needed
-        buf.write(bytes(f"\r\nBITMAP 70,0,{nbytes},{height},0,", "utf-8"))
-
-        for row in range(height):
-            line = bytearray(nbytes)
-            for byte, _ in enumerate(line):
-                b = 0xff
-                for bit in range(8):
-                    col = (byte * 8) + bit
-                    if col >= width:
-                        break
-
-                    idx = row * width + col
-                    v = image_data[idx]
-                    if v == 0:
-                        b &= ~(1 << (7 - bit))
-                line[byte] = b
-            buf.write(line)
-
-        buf.write(b"\r\n")
-
-        self.write_command(f"SIZE {height},{width}")
-        self.write_command("DIRECTION 0")
-        self.write_command("CLS")
-
-        self.ep_out.write(buf.getvalue())
-
-        self.write_command("PRINT 1,1")
-
-    def print_image(self, image, thread=False):
-        # Always wait for any previous print job
-        if self.print_proc:
-            self.print_proc.join()
-            self.print_proc = None
-
-        width = image.width
-        height = image.height
-        image_data = image.getdata()
-
-        if thread:
-            self.print_proc = multiprocessing.Process(target=self.__print_image,
-                                                      args=(width, height, image_data))
-            self.print_proc.start()
-        else:
-            self.__print_image(width, height, image_data)
+        # Only the parts with ink are sent, each as its own BITMAP. The rest
+        # of the label is left blank by CLS.
+        with stats.timer("encode", self.model):
+            for x, y, region in ink_regions(raster, self.ink):
+                # TODO: I don't know why x offset of 70 is needed
+                buf.write(bytes(f"\r\nBITMAP {70 + x},{y},{region.stride},{region.height},0,", "utf-8"))
+                buf.write(region.data)
+                buf.write(b"\r\n")
+
+        with self.io_lock, stats.timer("usb_write", self.model):
+            self.write_command(f"SIZE {raster.height},{raster.width}")
+            self.write_command("DIRECTION 0")
+            self.write_command("CLS")
+
+            self.ep_out.write(buf.getvalue())
+
+            self.write_command("PRINT 1,1")
+
+    def print_image(self, image, rotate=0):
+        with stats.timer("pack", self.model):
+            raster = pack_image(image, ink=self.ink, rotate=rotate)
+        self.print_raster(raster)
 
 class PrinterVretti420B(PrinterTSPL):
-    def __init__(self):
-        super().__init__(0x2d84, 0x71a9)
+    model = "vretti"
+
+    def __init__(self, endpoints=None):
+        super().__init__(0x2d84, 0x71a9, endpoints)
 
 def main():
     printer = PrinterVretti420B()
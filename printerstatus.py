@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+# Printer states, as returned by the drivers' status()
+READY = "ready"
+BUSY = "busy"
+PAPER_OUT = "paper-out"
+ERROR = "error"
+# The printer didn't answer, or can't report its status
+UNKNOWN = "unknown"
+
+# Polls a printer's status() on a background thread.
+#
+# The latest state is kept in 'state', and on_change(state) is called (on the
+# monitor thread) whenever it changes. wait_ready() lets a print spooler send
+# the next job as soon as the printer is ready for it.
+#
+# The drivers hold a lock while printing, so a status poll never gets in the
+# middle of a job.
+class StatusMonitor():
+    def __init__(self, printer, interval=0.25, on_change=None):
+        self.printer = printer
+        self.interval = interval
+        self.on_change = on_change
+
+        self.state = UNKNOWN
+        # time.monotonic() of the last status read
+        self.updated = 0
+        self.cond = threading.Condition()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        self.poll()
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    # Read the status now
+    def poll(self):
+        try:
+            state = self.printer.status()
+        except Exception:
+            state = UNKNOWN
+
+        with self.cond:
+            changed = state != self.state
+            self.state = state
+            self.updated = time.monotonic()
+            self.cond.notify_all()
+
+        if changed and self.on_change:
+            self.on_change(state)
+
+        return state
+
+    # Wait until a status read made after 'since' (a time.monotonic()) says
+    # the printer is ready, or for up to 'timeout' seconds. If the printer
+    # can't report its status, just carry on.
+    # Returns True if it's ready.
+    def wait_ready(self, timeout=None, since=None):
+        def ready():
+            if since is not None and self.updated <= since:
+                return False
+            return self.state in (READY, UNKNOWN)
+
+        with self.cond:
+            return self.cond.wait_for(ready, timeout)
+
+    def __run(self):
+        while not self.stopping.wait(self.interval):
+            self.poll()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass
+
+from PIL import Image
+
+# Raster encoding shared by the printer drivers.
+#
+# Both printers take the label as a series of packed scanlines, with the
+# leftmost pixel in the MSB of the first byte. They differ in which value
+# means "ink": the Dymo sets a bit for a black dot, the TSPL printers clear it.
+# Pillow can already pack a mode '1' image like that in C, so we only need to
+# fix up the padding bits at the end of each row.
+
+@dataclass(frozen=True)
+class Raster:
+    width: int
+    height: int
+    # Bytes per packed row
+    stride: int
+    data: bytes
+
+    def row(self, idx):
+        start = idx * self.stride
+        return self.data[start:start + self.stride]
+
+    def rows(self):
+        for idx in range(self.height):
+            yield self.row(idx)
+
+# Rotations (counter-clockwise, in degrees) which can be applied while packing
+_rotations = {
+    0: None,
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# Translation tables to set the padding bits in the last byte of each row,
+# indexed by the number of padding bits
+_pad_tables = [bytes(b | ((1 << npad) - 1) for b in range(256)) for npad in range(8)]
+
+# Pack a mode '1' image into MSB-first rows, one bit per pixel.
+# Black pixels are encoded as 'ink' (0 or 1), white pixels and the padding
+# bits at the end of each row as the opposite value.
+#
+# 'rotate' gives the orientation (counter-clockwise degrees) the rows are
+# emitted in, so callers don't need to make a rotated copy of the image.
+# Reading the source column-by-column in Python turned out to be twice as
+# slow as Pillow's transpose, so that's used internally, and the temporary
+# is dropped as soon as it's packed.
+def pack_image(image, ink=1, rotate=0):
+    if image.mode != '1':
+        raise ValueError(f"can't pack image with mode '{image.mode}'")
+
+    if rotate not in _rotations:
+        raise ValueError(f"can't rotate by {rotate} degrees")
+
+    if _rotations[rotate] is not None:
+        image = image.transpose(_rotations[rotate])
+
+    width, height = image.size
+    stride = (width + 7) // 8
+
+    if ink:
+        # '1;I' packs inverted, with zero padding bits
+        data = image.tobytes('raw', '1;I')
+    else:
+        # '1' packs white as 1, but still with zero padding bits
+        data = image.tobytes('raw', '1')
+        npad = (stride * 8) - width
+        if npad and height:
+            buf = bytearray(data)
+            buf[stride - 1::stride] = buf[stride - 1::stride].translate(_pad_tables[npad])
+            data = bytes(buf)
+
+    return Raster(width, height, stride, data)
+
+# Roughly what it costs to send a region separately, in bytes of raster data.
+# Regions separated by a blank gap smaller than this are merged.
+REGION_OVERHEAD = 32
+
+# Find the parts of a packed raster which have any ink in them: runs of rows
+# which aren't completely blank, each cropped to the bytes which contain ink.
+# Used to avoid sending large blank margins to the printer.
+#
+# Returns a list of (x, y, Raster), with the offsets in pixels (x is always a
+# multiple of 8). The regions don't overlap, and everything outside them is
+# blank.
+def ink_regions(raster, ink):
+    stride = raster.stride
+    data = raster.data
+    blank = b'\x00' if ink else b'\xff'
+    blank_row = blank * stride
+
+    # (first row, last row, first byte, end byte)
+    runs = []
+    run = None
+    for y in range(raster.height):
+        row = data[y * stride:(y + 1) * stride]
+        if row == blank_row:
+            continue
+
+        x0 = stride - len(row.lstrip(blank))
+        x1 = len(row.rstrip(blank))
+        if run is not None and (y - run[1] - 1) * (run[3] - run[2]) < REGION_OVERHEAD:
+            run = (run[0], y, min(run[2], x0), max(run[3], x1))
+        else:
+            if run is not None:
+                runs.append(run)
+            run = (y, y, x0, x1)
+
+    if run is not None:
+        runs.append(run)
+
+    regions = []
+    for y0, y1, x0, x1 in runs:
+        region = b''.join(data[y * stride + x0:y * stride + x1] for y in range(y0, y1 + 1))
+        regions.append((x0 * 8, y0, Raster((x1 - x0) * 8, y1 - y0 + 1, x1 - x0, region)))
+
+    return regions
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import concurrent.futures
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from cache import LRUCache
+from label import Label
+from raster import pack_image
+import spooler
+from stats import stats, prometheus
+
+# Renders (and optionally prints) labels for other programs, over HTTP on a
+# TCP port or a Unix socket, so they can share one warm renderer instead of
+# starting Python and loading fonts for every label.
+#
+# POST /render   JSON body, replies with the label as a PNG, or packed
+#                rows (see raster.Raster) with the size in X-Raster-*
+#                headers:
+#                  "lines": as for Label (required)
+#                  "size_mm": [width, height] (default [89, 36])
+#                  "dpi", "padding_mm": (default: the printer's, or 300 and
+#                    no padding)
+#                  "format": "png" (default) or "raster"
+#                  "ink", "rotate": for "raster", as for pack_image()
+#                    (default: the printer's ink, no rotation)
+# POST /print    JSON body with "lines" and "size_mm", replies with the job
+#                ID: {"job": 1}
+# GET /jobs/ID   {"job": 1, "state": "done", "info": null}, see spooler. Only
+#                the last MAX_JOBS jobs are kept.
+# GET /status    {"printer": "ready", "dpi": 300, "padding_mm": [...]}
+# GET /metrics   Stage timings, in Prometheus' text format (see stats). The
+#                rendering workers' timings are saved every few seconds, so
+#                can lag a little.
+#
+# Errors are {"error": "..."}. Labels are rendered in a pool of worker
+# processes, and print jobs all go through one PrintSpooler.
+
+DEFAULT_SIZE_MM = (89, 36)
+
+# How many print jobs' states to remember for /jobs
+MAX_JOBS = 1024
+
+# Runs in a worker process
+def _render(lines, dpi, size_mm, padding_mm, fmt, ink, rotate):
+    img = Label(lines, dpi, size_mm, Label.Padding(*padding_mm)).image()
+
+    if fmt == 'png':
+        buf = io.BytesIO()
+        img.save(buf, 'PNG')
+        return buf.getvalue()
+    elif fmt == 'raster':
+        return pack_image(img, ink=ink, rotate=rotate)
+
+    return img
+
+# Load the fonts and fill the caches before the first real request
+def _warm_up(_):
+    _render(["Warm up"], 300, DEFAULT_SIZE_MM, (0, 0, 0, 0), None, 1, 0)
+
+class LabelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def __reply(self, status, body=b"", content_type="application/json", headers={}):
+        if content_type == "application/json":
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers.items():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __read_json(self):
+        req = json.loads(self.body)
+        if not isinstance(req, dict) or not req.get("lines"):
+            raise ValueError("request needs some 'lines'")
+
+        # Each line is text, or a list of columns of text
+        lines = req["lines"]
+        def valid(line):
+            if isinstance(line, list):
+                return all(isinstance(col, str) for col in line)
+            return isinstance(line, str)
+        if not isinstance(lines, list) or not all(valid(line) for line in lines):
+            raise ValueError("'lines' should be a list of strings (or lists of strings, for columns)")
+
+        return req
+
+    def __render(self, req, fmt):
+        printer = self.server.printer
+        size_mm = tuple(req.get("size_mm", DEFAULT_SIZE_MM))
+        if printer:
+            dpi, padding_mm, ink = printer.dpi, printer.padding(), printer.ink
+        else:
+            dpi, padding_mm, ink = 300, (0, 0, 0, 0), 1
+
+        if fmt != 'print':
+            dpi = int(req.get("dpi", dpi))
+            padding_mm = tuple(req.get("padding_mm", padding_mm))
+            ink = int(req.get("ink", ink))
+        rotate = int(req.get("rotate", 0)) if fmt == 'raster' else 0
+
+        if len(size_mm) != 2 or len(padding_mm) != 4:
+            raise ValueError("'size_mm' should be [width, height] and 'padding_mm' [left, top, right, bottom]")
+
+        fut = self.server.pool.submit(_render, req["lines"], dpi, size_mm, padding_mm, fmt, ink, rotate)
+        return fut.result()
+
+    def __handle(self, method):
+        server = self.server
+
+        # Always read the whole request, so the connection can be reused
+        # whatever the reply is
+        length = int(self.headers.get("Content-Length", 0))
+        self.body = self.rfile.read(length)
+
+        if method == "POST" and self.path == "/render":
+            req = self.__read_json()
+            fmt = req.get("format", "png")
+            if fmt not in ("png", "raster"):
+                raise ValueError(f"unknown format '{fmt}'")
+
+            res = self.__render(req, fmt)
+            if fmt == "png":
+                return self.__reply(200, res, "image/png")
+            return self.__reply(200, res.data, "application/octet-stream", {
+                "X-Raster-Width": res.width,
+                "X-Raster-Height": res.height,
+                "X-Raster-Stride": res.stride,
+            })
+        elif method == "POST" and self.path == "/print":
+            if not server.printer:
+                return self.__reply(503, {"error": "no printer"})
+            img = self.__render(self.__read_json(), 'print')
+            job_id = server.print_image(img)
+            state, info = server.job(job_id)
+            if state == spooler.FAILED:
+                return self.__reply(503, {"job": job_id, "error": info})
+            return self.__reply(202, {"job": job_id})
+        elif method == "GET" and self.path.startswith("/jobs/"):
+            if not server.printer:
+                return self.__reply(503, {"error": "no printer"})
+            job_id = int(self.path[len("/jobs/"):])
+            state, info = server.job(job_id)
+            if state is None:
+                return self.__reply(404, {"error": "no such job"})
+            return self.__reply(200, {"job": job_id, "state": state, "info": info})
+        elif method == "GET" and self.path == "/status":
+            if not server.printer:
+                return self.__reply(200, {"printer": None})
+            server.job(None)
+            return self.__reply(200, {
+                "printer": server.printer_state,
+                "dpi": server.printer.dpi,
+                "padding_mm": list(server.printer.padding()),
+            })
+
+        elif method == "GET" and self.path == "/metrics":
+            text = prometheus(stats.collect())
+            return self.__reply(200, text.encode(), "text/plain; version=0.0.4")
+
+        self.__reply(404, {"error": "bad request"})
+
+    def __handle_errors(self, method):
+        try:
+            self.__handle(method)
+        except (ValueError, TypeError, KeyError) as e:
+            self.__reply(400, {"error": str(e)})
+        except Exception as e:
+            self.__reply(500, {"error": str(e)})
+
+    def do_GET(self):
+        self.__handle_errors("GET")
+
+    def do_POST(self):
+        self.__handle_errors("POST")
+
+class UnixLabelHandler(LabelHandler):
+    disable_nagle_algorithm = False
+
+    # Unix socket clients don't have an address
+    def address_string(self):
+        return "unix"
+
+class LabelServer(ThreadingHTTPServer):
+    daemon_threads = True
+    handler_class = LabelHandler
+
+    # 'printer' is an open PrintSpooler, or None to only render
+    def __init__(self, address, printer=None, workers=None, verbose=False):
+        super().__init__(address, self.handler_class)
+        self.printer = printer
+        self.verbose = verbose
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.pool = concurrent.futures.ProcessPoolExecutor(workers)
+        list(self.pool.map(_warm_up, range(workers)))
+
+        # The spooler's status is only read here, with the lock held
+        self.lock = threading.Lock()
+        self.jobs = LRUCache(MAX_JOBS)
+        self.printer_state = None
+
+    def print_image(self, image):
+        with self.lock:
+            # Rotated the same way as in the UI
+            return self.printer.print_image(image, rotate=90)
+
+    # Returns (state, info) for a job, or (None, None) if it doesn't exist
+    # (or has been forgotten)
+    def job(self, job_id):
+        if not self.printer:
+            return None, None
+
+        with self.lock:
+            for update_id, state, info in self.printer.poll_status():
+                if state == spooler.PRINTER:
+                    self.printer_state = info
+                else:
+                    self.jobs.put(update_id, (state, info))
+            return self.jobs.get(job_id, (None, None))
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(cancel_futures=True)
+
+class UnixLabelServer(LabelServer):
+    address_family = socket.AF_UNIX
+    handler_class = UnixLabelHandler
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        os.unlink(self.server_address)
@@ -1,36 +1,192 @@
 #!/usr/bin/env python3
 
+from array import array
+import collections
+import fcntl
 import os
 import queue
-from playsound import playsound
+import statistics
+import subprocess
+import termios
+import threading
+import time
+import wave
 
-class SoundThread:
-    def __init__(self, queue, play_silence=False):
-        self.poll_time_ms = 1000 if play_silence else 100000
-        self.queue = queue
-        self.play_silence = play_silence
+# A decoded sound: wave parameters and raw PCM frames
+class Clip:
+    def __init__(self, nchannels, sampwidth, framerate, frames):
+        self.nchannels = nchannels
+        self.sampwidth = sampwidth
+        self.framerate = framerate
+        self.frames = frames
 
-        beep_wav = "beep.wav"
-        silence_wav = "silence.wav"
-        script_dir = os.path.dirname(os.path.realpath(__file__))
+    @property
+    def duration(self):
+        return len(self.frames) / (self.nchannels * self.sampwidth * self.framerate)
 
-        self.beep_file = os.path.join(script_dir, beep_wav)
-        self.silence_file = os.path.join(script_dir, silence_wav)
+    def same_format(self, other):
+        return (self.nchannels, self.sampwidth, self.framerate) == \
+               (other.nchannels, other.sampwidth, other.framerate)
 
-    def beep(self):
-        self.queue.put("beep")
+def load_wav(filename):
+    with wave.open(filename, 'rb') as w:
+        return Clip(w.getnchannels(), w.getsampwidth(), w.getframerate(),
+                    w.readframes(w.getnframes()))
 
-    def run(self):
+# Convert a 16-bit clip to another sample rate (nearest sample, which is
+# plenty for a beep)
+def resample(clip, framerate):
+    if clip.framerate == framerate:
+        return clip
+    if clip.sampwidth != 2:
+        raise ValueError(f"can't resample {clip.sampwidth * 8}-bit audio")
+
+    samples = array('h', clip.frames)
+    nin = len(samples) // clip.nchannels
+    nout = (nin * framerate) // clip.framerate
+    out = array('h')
+    for i in range(nout):
+        src = ((i * clip.framerate) // framerate) * clip.nchannels
+        out.extend(samples[src:src + clip.nchannels])
+
+    return Clip(clip.nchannels, clip.sampwidth, framerate, out.tobytes())
+
+# Sinks take raw PCM frames in one format for their whole lifetime.
+#
+# 'realtime' sinks play what they're given, so the engine keeps them fed with
+# silence (which also stops the audio device going to sleep). Their writes
+# block while they're full, which paces the engine by the device's clock.
+# 'latency' is roughly how long (seconds) audio written now takes to come out.
+
+# Plays through ALSA, with one long-running aplay reading from a pipe
+class AplaySink:
+    realtime = True
+
+    def __init__(self, clip_format, device=None, buffer_ms=50):
+        formats = {1: 'U8', 2: 'S16_LE', 4: 'S32_LE'}
+        cmd = ['aplay', '-q', '-t', 'raw',
+               '-f', formats[clip_format.sampwidth],
+               '-c', str(clip_format.nchannels),
+               '-r', str(clip_format.framerate),
+               f'--buffer-time={buffer_ms * 1000}']
+        if device:
+            cmd += ['-D', device]
+        cmd.append('-')
+
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self.buffer_latency = buffer_ms / 1000
+        self.bytes_per_second = clip_format.nchannels * clip_format.sampwidth * clip_format.framerate
+
+        # Anything in the pipe is still to be played, so keep it to about
+        # aplay's buffer (the kernel rounds it up to a page)
+        fcntl.fcntl(self.proc.stdin.fileno(), fcntl.F_SETPIPE_SZ,
+                    int(self.bytes_per_second * self.buffer_latency))
+
+    # What's waiting in the pipe, and then aplay's buffer
+    @property
+    def latency(self):
+        queued = array('i', [0])
+        fcntl.ioctl(self.proc.stdin.fileno(), termios.FIONREAD, queued)
+        return queued[0] / self.bytes_per_second + self.buffer_latency
+
+    def write(self, frames):
+        self.proc.stdin.write(frames)
+        self.proc.stdin.flush()
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+# Discards everything, but counts it
+class NullSink:
+    realtime = False
+    latency = 0
+
+    def __init__(self, clip_format=None):
+        self.writes = 0
+        self.bytes_written = 0
+
+    def write(self, frames):
+        self.writes += 1
+        self.bytes_written += len(frames)
+
+    def close(self):
+        pass
+
+# Writes everything to a wav file
+class FileSink:
+    realtime = False
+    latency = 0
+
+    def __init__(self, clip_format, filename):
+        self.wav = wave.open(filename, 'wb')
+        self.wav.setnchannels(clip_format.nchannels)
+        self.wav.setsampwidth(clip_format.sampwidth)
+        self.wav.setframerate(clip_format.framerate)
+
+    def write(self, frames):
+        self.wav.writeframes(frames)
+
+    def close(self):
+        self.wav.close()
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+BEEP_WAV = os.path.join(script_dir, "beep.wav")
+SILENCE_WAV = os.path.join(script_dir, "silence.wav")
+
+# Plays beeps with as little delay as possible.
+#
+# The sounds are decoded once, up front, and written to a single sink which
+# stays open, from a thread. Pass the sink class (and any extra arguments for
+# it) - it's created with the format of the beep.
+#
+# beep() takes the time.monotonic() of whatever caused it (e.g. a tag scan),
+# and the time until the beep should be heard is kept in 'latencies'.
+class SoundEngine:
+    def __init__(self, sink_class=AplaySink, sink_args=(), beep_file=BEEP_WAV, silence_file=SILENCE_WAV):
+        self.beep_clip = load_wav(beep_file)
+        self.silence_clip = resample(load_wav(silence_file), self.beep_clip.framerate)
+        if not self.silence_clip.same_format(self.beep_clip):
+            raise ValueError("SoundEngine: beep and silence have different formats")
+
+        self.sink = sink_class(self.beep_clip, *sink_args)
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=100)
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def beep(self, since=None):
+        self.requests.put(time.monotonic() if since is None else since)
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+        self.sink.close()
+
+    # (min, median, max) latency in ms, or None if nothing's played yet
+    def latency_ms(self):
+        if not self.latencies:
+            return None
+        lat = [l * 1000 for l in self.latencies]
+        return min(lat), statistics.median(lat), max(lat)
+
+    def __run(self):
         while True:
             try:
-                cmd = self.queue.get(block=True, timeout=self.poll_time_ms * 1e-3)
-                if cmd == "stop":
-                    return
-                elif cmd == "beep":
-                    playsound(self.beep_file)
+                # A realtime sink is written to whenever it has room, which is
+                # at least every silence clip
+                since = self.requests.get(block=not self.sink.realtime)
             except queue.Empty:
-                if self.play_silence:
-                    playsound(self.silence_file)
+                self.sink.write(self.silence_clip.frames)
+                continue
 
-    def stop(self):
-        self.queue.put("stop")
+            if since is None:
+                return
+
+            # It'll be played after everything that's already been written
+            start = time.monotonic() + self.sink.latency
+            self.sink.write(self.beep_clip.frames)
+            self.latencies.append(start - since)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import itertools
+import multiprocessing
+import queue
+import time
+
+from printerstatus import StatusMonitor
+
+QUEUED = "queued"
+SENDING = "sending"
+PRINTING = "printing"
+DONE = "done"
+FAILED = "failed"
+
+# Status updates with this state report the printer's state (see
+# printerstatus) rather than a job's
+PRINTER = "printer"
+
+# How long close() waits for the worker to finish the job it's on before
+# killing it (seconds)
+CLOSE_TIMEOUT = 5
+# How often a job waiting for the printer checks whether the spooler's being
+# closed (seconds)
+STOP_POLL_INTERVAL = 0.1
+
+# Runs in the spooler process, which owns the printer for its whole lifetime
+def _spool(printer_class, printer_args, jobs, status, stopping, ready_timeout):
+    try:
+        printer = printer_class(*printer_args)
+    except Exception as e:
+        status.put((None, FAILED, str(e)))
+        return
+
+    status.put((None, "ready", (printer.dpi, printer.padding(), printer.ink)))
+
+    monitor = StatusMonitor(printer,
+                            on_change=lambda state: status.put((None, PRINTER, state)))
+    monitor.start()
+
+    # Like monitor.wait_ready(), but gives up if the spooler's being closed
+    def wait_ready(since=None):
+        end = time.monotonic() + ready_timeout
+        while not stopping.is_set():
+            remaining = end - time.monotonic()
+            if monitor.wait_ready(max(0, min(remaining, STOP_POLL_INTERVAL)), since):
+                return True
+            if remaining <= 0:
+                return False
+        return False
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, image, kwargs = job
+        if stopping.is_set():
+            status.put((job_id, FAILED, "cancelled"))
+            continue
+
+        # Hold the job until the printer's ready for it, e.g. after the
+        # labels have been changed
+        if not wait_ready():
+            status.put((job_id, FAILED, f"printer {monitor.state}"))
+            continue
+
+        status.put((job_id, SENDING, None))
+        try:
+            printer.print_image(image, **kwargs)
+        except Exception as e:
+            status.put((job_id, FAILED, str(e)))
+            continue
+
+        # It's done once the printer says it's ready again
+        status.put((job_id, PRINTING, None))
+        if wait_ready(since=time.monotonic()):
+            status.put((job_id, DONE, None))
+        else:
+            status.put((job_id, FAILED, f"printer {monitor.state}"))
+
+    monitor.stop()
+    printer.close()
+
+# A printer which hands print jobs to a long-lived worker process.
+#
+# The worker creates (and so owns) the real printer, and prints jobs from a
+# bounded queue one at a time. print_image() never blocks (it's called from
+# the UI thread): if the queue is full the job is failed straight away. Job
+# status updates (queued, sending, printing, done, failed) are collected with
+# poll_status().
+#
+# The printer's status is monitored in the worker. Each job is sent as soon
+# as the printer is ready for it, and is done once the printer's finished
+# with it. Jobs fail if the printer isn't ready within 'ready_timeout'
+# seconds. Changes in the printer's state are reported by poll_status() too.
+class PrintSpooler():
+    def __init__(self, printer_class, printer_args=(), maxsize=16, start_timeout=10, ready_timeout=60):
+        self.jobs = multiprocessing.Queue(maxsize)
+        self.status = multiprocessing.Queue()
+        self.stopping = multiprocessing.Event()
+        self.job_ids = itertools.count(1)
+        self.updates = []
+
+        self.proc = multiprocessing.Process(target=_spool,
+                                            args=(printer_class, printer_args, self.jobs, self.status,
+                                                  self.stopping, ready_timeout),
+                                            daemon=True)
+        self.proc.start()
+
+        # Wait for the printer to be opened, which also tells us its properties
+        try:
+            _, state, info = self.status.get(timeout=start_timeout)
+        except queue.Empty:
+            state, info = FAILED, "timed out waiting for printer"
+
+        if state == FAILED:
+            # The worker might be stuck opening the printer
+            self.proc.terminate()
+            self.proc.join(CLOSE_TIMEOUT)
+            raise ValueError(f"PrintSpooler: {info}")
+
+        self.__dpi, self.__padding, self.__ink = info
+
+    @property
+    def dpi(self):
+        return self.__dpi
+
+    # In mm, (left, top, right, bottom)
+    def padding(self):
+        return self.__padding
+
+    # Value for black pixels in packed rasters, see raster.pack_image()
+    @property
+    def ink(self):
+        return self.__ink
+
+    # Queue an image for printing, returns the job ID
+    def submit(self, image, block=False, timeout=None, **kwargs):
+        job_id = next(self.job_ids)
+        try:
+            self.jobs.put((job_id, image, kwargs), block=block, timeout=timeout)
+            self.updates.append((job_id, QUEUED, None))
+        except queue.Full:
+            self.updates.append((job_id, FAILED, "print queue full"))
+        return job_id
+
+    def print_image(self, image, **kwargs):
+        return self.submit(image, **kwargs)
+
+    # Returns a list of (job_id, state, error) for all status changes since
+    # the last call. Printer state changes are (None, PRINTER, printer state).
+    # Never blocks.
+    def poll_status(self):
+        updates = self.updates
+        self.updates = []
+        while True:
+            try:
+                updates.append(self.status.get_nowait())
+            except queue.Empty:
+                return updates
+
+    # Jobs which haven't been sent yet are cancelled (and reported as failed
+    # by poll_status()). The job being sent is given CLOSE_TIMEOUT seconds
+    # to finish.
+    def close(self):
+        self.stopping.set()
+        while True:
+            try:
+                job_id, _, _ = self.jobs.get_nowait()
+                self.updates.append((job_id, FAILED, "cancelled"))
+            except queue.Empty:
+                break
+
+        try:
+            self.jobs.put(None, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+
+        self.proc.join(CLOSE_TIMEOUT)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join(CLOSE_TIMEOUT)
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+import bisect
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+
+# Timing for each stage of getting a label out, from reading the tag to the
+# USB writes, so that "it's slow" can be pinned down to a stage.
+#
+# Stages are timed with e.g.:
+#
+#   with stats.timer("lookup"):
+#       ...
+#
+# and kept as histograms, per stage and per printer model (where there is
+# one). Recording a time is a bisect and a few additions, so it's always on.
+#
+# Each process (the UI, the print spooler, rendering workers...) has its own
+# histograms. After enable(), they're saved to a file per process in a stats
+# directory every few seconds (if anything's changed) and on exit, and load()
+# merges all of those. The files of processes which have exited are merged
+# into one archive file, so there's only ever a file per running process,
+# plus the archive. See "main.py stats".
+#
+# reset() leaves a marker in the directory, so that running processes drop
+# what they'd recorded before it instead of saving it again.
+
+STAGES = ["read_tag", "lookup", "render", "pack", "encode", "usb_write"]
+
+DEFAULT_STATS_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "badger", "stats")
+
+# Bucket upper bounds (seconds): 4 per doubling, from 50 us to about 100 s.
+# Percentiles are interpolated within a bucket, so they're within ~20%.
+BUCKETS_PER_DOUBLING = 4
+BOUNDS = [0.00005 * 2 ** (i / BUCKETS_PER_DOUBLING) for i in range(85)]
+
+class Histogram:
+    def __init__(self):
+        # The last count is for anything above the last bound
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    # p is 0-100. Returns seconds, or None if there's nothing recorded.
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+
+        rank = self.count * p / 100
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BOUNDS[i - 1] if i > 0 else 0
+                upper = BOUNDS[i] if i < len(BOUNDS) else BOUNDS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+
+        return BOUNDS[-1]
+
+    def to_dict(self):
+        return {"counts": self.counts, "count": self.count, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls()
+        if len(d["counts"]) != len(h.counts):
+            raise ValueError("histogram has different buckets")
+        h.counts = list(d["counts"])
+        h.count = d["count"]
+        h.sum = d["sum"]
+        return h
+
+class Timer:
+    def __init__(self, stats, stage, printer):
+        self.stats = stats
+        self.stage = stage
+        self.printer = printer
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.observe(self.stage, time.perf_counter() - self.start, self.printer)
+        return False
+
+class Stats:
+    def __init__(self):
+        self.dirname = None
+        self.interval = None
+        # The last reset() seen in dirname, see save()
+        self.reset_id = None
+        self.__reset_process()
+
+    def timer(self, stage, printer=""):
+        return Timer(self, stage, printer)
+
+    def observe(self, stage, seconds, printer=""):
+        key = (stage, printer)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(seconds)
+            self.dirty = True
+
+    # Start saving this process's histograms (and those of any processes
+    # forked from it) in 'dirname'
+    def enable(self, dirname=DEFAULT_STATS_DIR, interval=10):
+        os.makedirs(dirname, exist_ok=True)
+        compact(dirname)
+        self.reset_id = _read_reset_id(dirname)
+        self.dirname = dirname
+        self.interval = interval
+        self.__start_saving()
+        self.__save_at_exit()
+
+    def snapshot(self):
+        with self.lock:
+            return {key: Histogram.from_dict(h.to_dict()) for key, h in self.histograms.items()}
+
+    # Everything saved so far by all processes if saving is enabled (with
+    # this process's up to date), otherwise just this process's histograms
+    def collect(self):
+        if not self.dirname:
+            return self.snapshot()
+        self.save()
+        return load(self.dirname)
+
+    def save(self):
+        if not self.dirname:
+            return
+
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = {
+                "pid": os.getpid(),
+                "process": os.path.basename(sys.argv[0]),
+                "saved": time.time(),
+                "histograms": [{"stage": stage, "printer": printer, **h.to_dict()}
+                               for (stage, printer), h in self.histograms.items()],
+            }
+
+        try:
+            with _lock(self.dirname):
+                reset_id = _read_reset_id(self.dirname)
+                if reset_id != self.reset_id:
+                    # Everything so far was reset since the last save
+                    with self.lock:
+                        self.reset_id = reset_id
+                        self.histograms = {}
+                        self.dirty = False
+                    return
+                _write(os.path.join(self.dirname, self.name + ".json"), data)
+        except OSError:
+            self.dirty = True
+            raise
+
+    # Each process needs its own file, and mustn't count what its parent did
+    def __reset_process(self):
+        self.name = f"{os.getpid()}-{time.time_ns()}"
+        self.lock = threading.Lock()
+        # (stage, printer model) -> Histogram, printer is "" if there isn't one
+        self.histograms = {}
+        # Whether there's anything new since the last save
+        self.dirty = False
+
+    def __start_saving(self):
+        thread = threading.Thread(target=self.__autosave, daemon=True)
+        thread.start()
+
+    def __save_at_exit(self):
+        import atexit
+        import multiprocessing.util
+        atexit.register(self.save)
+        # multiprocessing's children (the print spooler, process pools) don't
+        # run atexit handlers, but they do run its finalizers. They have to be
+        # registered after multiprocessing has cleared out the parent's.
+        multiprocessing.util.register_after_fork(self, Stats.__save_at_child_exit)
+
+    def __save_at_child_exit(self):
+        import multiprocessing.util
+        multiprocessing.util.Finalize(None, self.save, exitpriority=10)
+
+    def __autosave(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except OSError as e:
+                print("Couldn't save stats:", e)
+
+    def after_fork(self):
+        self.__reset_process()
+        if self.dirname:
+            self.__start_saving()
+
+stats = Stats()
+os.register_at_fork(after_in_child=stats.after_fork)
+
+ARCHIVE = "archive.json"
+# Written by reset(), it's changed by each one
+RESET_MARKER = ".reset"
+
+def _write(filename, data):
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, filename)
+
+def _read(filename):
+    with open(filename) as f:
+        return {(d["stage"], d["printer"]): Histogram.from_dict(d)
+                for d in json.load(f)["histograms"]}
+
+def _read_reset_id(dirname):
+    try:
+        with open(os.path.join(dirname, RESET_MARKER)) as f:
+            return json.load(f)["reset"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _merge(into, histograms):
+    for key, h in histograms.items():
+        if key in into:
+            into[key].merge(h)
+        else:
+            into[key] = h
+
+# Saved by a process which has exited?
+def _process_exited(name):
+    try:
+        pid = int(name.split("-")[0])
+    except ValueError:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+# Held while archiving, reading or saving the files, so that nothing's
+# archived twice, missed by a reader, or saved across a reset
+def _lock(dirname):
+    lock = open(os.path.join(dirname, ".lock"), "w")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+# Merge the files of processes which have exited into the archive, and
+# delete them. Call with the lock held.
+def _compact(dirname):
+    names = [n for n in os.listdir(dirname)
+             if n != ARCHIVE and n.endswith((".json", ".tmp")) and _process_exited(n)]
+    if not names:
+        return
+
+    archive_file = os.path.join(dirname, ARCHIVE)
+    archive = {}
+    if os.path.exists(archive_file):
+        archive = _read(archive_file)
+
+    for name in names:
+        if name.endswith(".json"):
+            try:
+                _merge(archive, _read(os.path.join(dirname, name)))
+            except (OSError, ValueError, KeyError):
+                pass
+
+    _write(archive_file, {
+        "histograms": [{"stage": stage, "printer": printer, **h.to_dict()}
+                       for (stage, printer), h in archive.items()],
+    })
+    for name in names:
+        os.unlink(os.path.join(dirname, name))
+
+def compact(dirname=DEFAULT_STATS_DIR):
+    if not os.path.isdir(dirname):
+        return
+    with _lock(dirname):
+        _compact(dirname)
+
+# Merge all the saved histograms in 'dirname', as {(stage, printer): Histogram}
+def load(dirname=DEFAULT_STATS_DIR):
+    merged = {}
+    if not os.path.isdir(dirname):
+        return merged
+
+    with _lock(dirname):
+        _compact(dirname)
+
+        for name in os.listdir(dirname):
+            if not name.endswith(".json"):
+                continue
+            try:
+                _merge(merged, _read(os.path.join(dirname, name)))
+            except (OSError, ValueError, KeyError):
+                continue
+
+    return merged
+
+def reset(dirname=DEFAULT_STATS_DIR):
+    if not os.path.isdir(dirname):
+        return
+    with _lock(dirname):
+        for name in os.listdir(dirname):
+            if name.endswith((".json", ".tmp")):
+                os.unlink(os.path.join(dirname, name))
+        _write(os.path.join(dirname, RESET_MARKER), {"reset": time.time_ns()})
+
+def _sort_key(key):
+    stage, printer = key
+    order = STAGES.index(stage) if stage in STAGES else len(STAGES)
+    return (order, stage, printer)
+
+# A table of count and p50/p95/p99 (ms) for each stage
+def summary(histograms):
+    lines = [f"{'stage':<12} {'printer':<8} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for key in sorted(histograms, key=_sort_key):
+        h = histograms[key]
+        pct = [f"{h.percentile(p) * 1000:9.2f}" for p in (50, 95, 99)]
+        lines.append(f"{key[0]:<12} {key[1] or '-':<8} {h.count:>8} {' '.join(pct)}")
+    return "\n".join(lines)
+
+def _labels(stage, printer, **extra):
+    labels = {"stage": stage, "printer": printer, **extra}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+# Prometheus text exposition format: a histogram per stage (with a bucket per
+# doubling), and the percentiles as gauges
+def prometheus(histograms):
+    keys = sorted(histograms, key=_sort_key)
+    out = ["# HELP badger_stage_seconds Time taken by each stage of printing a label",
+           "# TYPE badger_stage_seconds histogram"]
+    for key in keys:
+        h = histograms[key]
+        cumulative = 0
+        for i, n in enumerate(h.counts[:-1]):
+            cumulative += n
+            if i % BUCKETS_PER_DOUBLING == 0:
+                out.append(f"badger_stage_seconds_bucket{_labels(*key, le=f'{BOUNDS[i]:.6g}')} {cumulative}")
+        out.append(f"badger_stage_seconds_bucket{_labels(*key, le='+Inf')} {h.count}")
+        out.append(f"badger_stage_seconds_sum{_labels(*key)} {h.sum:.6f}")
+        out.append(f"badger_stage_seconds_count{_labels(*key)} {h.count}")
+
+    out += ["# HELP badger_stage_seconds_percentile Percentiles of badger_stage_seconds",
+            "# TYPE badger_stage_seconds_percentile gauge"]
+    for key in keys:
+        for p in (50, 95, 99):
+            value = histograms[key].percentile(p)
+            out.append(f"badger_stage_seconds_percentile{_labels(*key, quantile=p / 100)} {value:.6f}")
+
+    return "\n".join(out) + "\n"
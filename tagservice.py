@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass
+import queue
+import threading
+import time
+
+from stats import stats
+
+TAG_ARRIVED = "arrived"
+TAG_REMOVED = "removed"
+
+@dataclass(frozen=True)
+class TagEvent:
+    kind: str
+    tag: bytes
+    # Button state when the tag arrived (see TagReader.read_buttons())
+    buttons: int
+    # time.monotonic() when the event was detected
+    timestamp: float
+
+# Polls a tag reader on a background thread, so that the (blocking) serial
+# I/O never runs on the UI thread.
+#
+# Works with anything which has read_tag() and read_buttons(), i.e. TagReader
+# and FakeTagReader. Arrivals and removals are delivered as TagEvents on a
+# thread-safe queue, collected with get_events().
+class TagReaderService():
+    def __init__(self, tagreader, poll_interval=0.1):
+        self.tagreader = tagreader
+        self.poll_interval = poll_interval
+        self.events = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    # Returns all events since the last call. Never blocks.
+    def get_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def __emit(self, kind, tag, buttons=0):
+        self.events.put(TagEvent(kind, tag, buttons, time.monotonic()))
+
+    def __run(self):
+        present = None
+        while not self.stopping.wait(self.poll_interval):
+            try:
+                start = time.perf_counter()
+                tag = self.tagreader.read_tag()
+                if tag and tag != present:
+                    # Only reads which found a new tag are timed, the idle
+                    # polls in between aren't part of a scan
+                    stats.observe("read_tag", time.perf_counter() - start)
+                    buttons = self.tagreader.read_buttons()
+            except Exception as e:
+                print("Tag reader error:", e)
+                continue
+
+            if tag == present:
+                continue
+
+            if present:
+                self.__emit(TAG_REMOVED, present)
+
+            if tag:
+                self.__emit(TAG_ARRIVED, tag, buttons)
+
+            present = tag
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import requests
+
+from db_sett import Database
+from fakeserver import FakeMemberServer
+
+TAG = bytes.fromhex("4777701d")
+OTHER_TAG = bytes.fromhex("01020304")
+
+class RemoteDatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeMemberServer().start()
+        self.server.members[TAG.hex()] = {"name": "Jane Doe", "contactData": "jane@example.com"}
+        self.db = Database(self.server.base_url, backoff=0)
+
+    def tearDown(self):
+        self.db.close()
+        self.server.stop()
+
+    def test_lookup(self):
+        self.assertEqual(self.db.lookup(TAG), ("Jane Doe", "jane@example.com"))
+
+    def test_lookup_not_found(self):
+        with self.assertRaises(RuntimeError):
+            self.db.lookup(OTHER_TAG)
+
+    def test_insert_update_delete(self):
+        self.db.insert(OTHER_TAG, "John Smith", "john@example.com")
+        self.assertEqual(self.server.members[OTHER_TAG.hex()]["name"], "John Smith")
+
+        self.db.update(OTHER_TAG, "John Smith", "Trustee")
+        self.assertEqual(self.server.members[OTHER_TAG.hex()]["contactData"], "Trustee")
+
+        self.db.delete(OTHER_TAG)
+        self.assertNotIn(OTHER_TAG.hex(), self.server.members)
+
+    def test_lookup_is_cached(self):
+        self.db.lookup(TAG)
+        self.db.lookup(TAG)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_no_cache(self):
+        db = Database(self.server.base_url, cache_ttl=0)
+        db.lookup(TAG)
+        db.lookup(TAG)
+        db.close()
+        self.assertEqual(self.server.requests, 2)
+
+    def test_update_refreshes_cache(self):
+        self.db.lookup(TAG)
+        self.db.update(TAG, "Jane Doe", "Events team")
+        self.assertEqual(self.db.lookup(TAG), ("Jane Doe", "Events team"))
+        # The GET, the PUT, and no second GET
+        self.assertEqual(self.server.requests, 2)
+
+    def test_delete_invalidates_cache(self):
+        self.db.lookup(TAG)
+        self.db.delete(TAG)
+        with self.assertRaises(RuntimeError):
+            self.db.lookup(TAG)
+
+    def test_retry_on_503(self):
+        self.server.failures = [503]
+        self.assertEqual(self.db.lookup(TAG), ("Jane Doe", "jane@example.com"))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_gives_up_after_retries(self):
+        self.server.failures = [503] * 10
+        with self.assertRaises(requests.RequestException):
+            self.db.lookup(TAG)
+        # The first try, and one retry
+        self.assertEqual(self.server.requests, 2)
+
+    def test_read_timeout(self):
+        self.server.delay = 0.3
+        db = Database(self.server.base_url, read_timeout=0.1, retries=1, backoff=0, cache_ttl=0)
+        with self.assertRaises(requests.ConnectionError):
+            db.lookup(TAG)
+        db.close()
+        self.assertEqual(self.server.requests, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import http.client
+import json
+import threading
+import unittest
+
+import server
+import spooler
+
+# Stands in for a PrintSpooler: jobs are "printed" straight away
+class FakeSpooler:
+    dpi = 300
+    ink = 1
+
+    def __init__(self):
+        self.job_id = 0
+        self.updates = []
+
+    def padding(self):
+        return (2, 0, 2, 0)
+
+    def print_image(self, image, **kwargs):
+        self.job_id += 1
+        self.updates.append((self.job_id, spooler.DONE, None))
+        return self.job_id
+
+    def poll_status(self):
+        updates = self.updates
+        self.updates = []
+        return updates
+
+class LabelServerTest(unittest.TestCase):
+    printer = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = server.LabelServer(("127.0.0.1", 0), cls.printer, workers=1)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.server.server_port)
+        conn.request(method, path, json.dumps(body) if body is not None else None)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        if resp.getheader("Content-Type") == "application/json":
+            data = json.loads(data)
+        return resp.status, data
+
+class NoPrinterTest(LabelServerTest):
+    def test_render_png(self):
+        status, data = self.request("POST", "/render", {"lines": ["Jane Doe", "Events team"]})
+        self.assertEqual(status, 200)
+        self.assertTrue(data.startswith(b"\x89PNG"))
+
+    def test_render_columns(self):
+        status, _ = self.request("POST", "/render", {"lines": [["Date in", "Use by"]]})
+        self.assertEqual(status, 200)
+
+    def test_lines_must_be_list_of_strings(self):
+        for lines in ["Jane", ["Jane", 1], [["Jane", None]], {"a": "b"}]:
+            status, data = self.request("POST", "/render", {"lines": lines})
+            self.assertEqual(status, 400, lines)
+            self.assertIn("error", data)
+
+    def test_bad_rotate(self):
+        status, _ = self.request("POST", "/render", {"lines": ["Jane"], "format": "raster", "rotate": "up"})
+        self.assertEqual(status, 400)
+
+    def test_print(self):
+        status, _ = self.request("POST", "/print", {"lines": ["Jane"]})
+        self.assertEqual(status, 503)
+
+    def test_jobs(self):
+        status, data = self.request("GET", "/jobs/1")
+        self.assertEqual(status, 503)
+        self.assertEqual(data, {"error": "no printer"})
+
+    def test_status(self):
+        self.assertEqual(self.request("GET", "/status"), (200, {"printer": None}))
+
+class PrinterTest(LabelServerTest):
+    printer = FakeSpooler()
+
+    def test_print_and_job(self):
+        status, data = self.request("POST", "/print", {"lines": ["Jane"]})
+        self.assertEqual(status, 202)
+
+        status, data = self.request("GET", f"/jobs/{data['job']}")
+        self.assertEqual(status, 200)
+        self.assertEqual(data["state"], spooler.DONE)
+
+    def test_unknown_job(self):
+        status, _ = self.request("GET", "/jobs/9999")
+        self.assertEqual(status, 404)
+
+    def test_jobs_are_bounded(self):
+        for _ in range(server.MAX_JOBS + 10):
+            self.server.print_image(None)
+        self.server.job(None)
+        self.assertEqual(len(self.server.jobs), server.MAX_JOBS)
+
+if __name__ == "__main__":
+    unittest.main()
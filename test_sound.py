@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+import sound
+
+# Stands in for a sound card behind a small buffer: it plays 'speed' seconds
+# of audio per second, and writes block while the buffer's full
+class FakeDeviceSink:
+    realtime = True
+
+    def __init__(self, clip_format, capacity=0.1, speed=0.9):
+        self.bytes_per_second = clip_format.nchannels * clip_format.sampwidth * clip_format.framerate
+        self.capacity = capacity
+        self.speed = speed
+        self.start = time.monotonic()
+        self.written = 0.0
+        self.lock = threading.Lock()
+
+    def played(self):
+        return (time.monotonic() - self.start) * self.speed
+
+    @property
+    def latency(self):
+        with self.lock:
+            return max(0, self.written - self.played()) / self.speed
+
+    def write(self, frames):
+        with self.lock:
+            self.written = max(self.written, self.played()) + len(frames) / self.bytes_per_second
+        while self.latency > self.capacity:
+            time.sleep(0.005)
+
+    def close(self):
+        pass
+
+class SoundEngineTest(unittest.TestCase):
+    def test_paced_by_device(self):
+        engine = sound.SoundEngine(FakeDeviceSink).start()
+        try:
+            time.sleep(1)
+            since = time.monotonic()
+            engine.beep(since)
+            time.sleep(0.1)
+        finally:
+            engine.stop()
+
+        # Only the device's buffer is ever queued, even with its clock slow
+        sink = engine.sink
+        self.assertLess(sink.written - sink.played(), (sink.capacity + 0.05) * sink.speed)
+        _, _, high = engine.latency_ms()
+        self.assertLess(high, (sink.capacity + 0.05) * 1000 / sink.speed)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+
+from PIL import Image
+
+from fakeusb import fake_endpoints
+from printer_tspl import PrinterVretti420B, STATUS_PAPER_OUT
+import spooler
+
+def hanging_printer():
+    time.sleep(60)
+
+def fake_vretti(status=0):
+    endpoints = fake_endpoints()
+    endpoints[1].set_default_response(bytes([status]))
+    return PrinterVretti420B(endpoints=endpoints)
+
+# Collect status updates until every job is done or failed
+def wait_for_jobs(spool, job_ids, timeout=10):
+    states = {}
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        for job_id, state, info in spool.poll_status():
+            if job_id in job_ids:
+                states[job_id] = (state, info)
+        if all(states.get(j, (None,))[0] in (spooler.DONE, spooler.FAILED) for j in job_ids):
+            break
+        time.sleep(0.05)
+    return states
+
+class PrintSpoolerTest(unittest.TestCase):
+    def setUp(self):
+        self.image = Image.new('1', (400, 200), 1)
+
+    def test_burst_of_prints(self):
+        spool = spooler.PrintSpooler(fake_vretti)
+        try:
+            job_ids = [spool.print_image(self.image) for _ in range(6)]
+            states = wait_for_jobs(spool, job_ids)
+        finally:
+            spool.close()
+
+        self.assertEqual([states[j][0] for j in job_ids], [spooler.DONE] * 6)
+
+    def test_full_queue(self):
+        # The printer never gets ready, so the queue never drains
+        spool = spooler.PrintSpooler(fake_vretti, (STATUS_PAPER_OUT,), maxsize=1, ready_timeout=0.5)
+        try:
+            start = time.monotonic()
+            job_ids = [spool.print_image(self.image) for _ in range(3)]
+            # Without waiting for room
+            self.assertLess(time.monotonic() - start, 0.1)
+            states = wait_for_jobs(spool, job_ids)
+        finally:
+            spool.close()
+
+        self.assertIn((spooler.FAILED, "print queue full"), states.values())
+
+    def test_start_timeout(self):
+        start = time.monotonic()
+        with self.assertRaises(ValueError):
+            spooler.PrintSpooler(hanging_printer, start_timeout=0.5)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_close_cancels_jobs(self):
+        spool = spooler.PrintSpooler(fake_vretti, (STATUS_PAPER_OUT,), ready_timeout=60)
+        job_ids = [spool.print_image(self.image) for _ in range(5)]
+
+        start = time.monotonic()
+        spool.close()
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertFalse(spool.proc.is_alive())
+
+        states = {job_id: state for job_id, state, _ in spool.poll_status() if job_id}
+        self.assertEqual([states[j] for j in job_ids], [spooler.FAILED] * 5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import stats
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dirname = self.tmp.name
+        self.stats = stats.Stats()
+        self.stats.dirname = self.dirname
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_percentiles(self):
+        h = stats.Histogram()
+        for ms in range(1, 101):
+            h.observe(ms / 1000)
+        self.assertEqual(h.count, 100)
+        for p in (50, 95, 99):
+            self.assertAlmostEqual(h.percentile(p), p / 1000, delta=p / 1000 * 0.2)
+
+    def test_saves_only_when_changed(self):
+        self.stats.save()
+        self.assertEqual(os.listdir(self.dirname), [])
+
+        self.stats.observe("lookup", 0.001)
+        self.stats.save()
+        filename = os.path.join(self.dirname, self.stats.name + ".json")
+
+        os.utime(filename, ns=(0, 0))
+        self.stats.save()
+        self.assertEqual(os.stat(filename).st_mtime_ns, 0)
+
+        self.stats.observe("lookup", 0.001)
+        self.stats.save()
+        self.assertNotEqual(os.stat(filename).st_mtime_ns, 0)
+
+    def test_exited_processes_are_archived(self):
+        self.stats.observe("render", 0.01)
+        self.stats.save()
+
+        # Two processes which have been and gone
+        code = ("import stats; s = stats.Stats(); s.dirname = sys.argv[1]; "
+                "s.observe('render', 0.02); s.observe('pack', 0.001, 'd450'); s.save()")
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", "import sys; " + code, self.dirname],
+                           check=True, cwd=os.path.dirname(os.path.abspath(stats.__file__)))
+        self.assertEqual(len([n for n in os.listdir(self.dirname) if not n.startswith(".")]), 3)
+
+        histograms = stats.load(self.dirname)
+        self.assertEqual(histograms[("render", "")].count, 3)
+        self.assertEqual(histograms[("pack", "d450")].count, 2)
+
+        # Only this process's file and the archive are left, and loading
+        # again doesn't count anything twice
+        files = sorted(n for n in os.listdir(self.dirname) if not n.startswith("."))
+        self.assertEqual(files, sorted([self.stats.name + ".json", stats.ARCHIVE]))
+        self.assertEqual(stats.load(self.dirname)[("render", "")].count, 3)
+
+    def test_reset_drops_running_processes_counts(self):
+        self.stats.observe("lookup", 0.001)
+        self.stats.save()
+
+        stats.reset(self.dirname)
+        # What this process recorded before the reset isn't saved again...
+        self.stats.observe("lookup", 0.001)
+        self.stats.save()
+        self.assertEqual(stats.load(self.dirname), {})
+
+        # ...but what it records afterwards is
+        self.stats.observe("lookup", 0.001)
+        self.stats.save()
+        self.assertEqual(stats.load(self.dirname)[("lookup", "")].count, 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+from worker import BackgroundWorker
+
+# Stands in for a Tk widget: after() callbacks are run by run_after()
+class FakeWidget:
+    def __init__(self):
+        self.pending = {}
+        self.next_id = 0
+
+    def after(self, ms, func):
+        self.next_id += 1
+        self.pending[self.next_id] = func
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    # Run the scheduled callbacks, as the mainloop would
+    def run_after(self):
+        pending, self.pending = self.pending, {}
+        for func in pending.values():
+            func()
+
+class BackgroundWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.widget = FakeWidget()
+        self.worker = BackgroundWorker(self.widget)
+
+    def tearDown(self):
+        self.worker.shutdown()
+
+    # Run after() callbacks until cond() is true
+    def run_until(self, cond, timeout=5):
+        end = time.monotonic() + timeout
+        while not cond() and time.monotonic() < end:
+            self.widget.run_after()
+            time.sleep(0.01)
+        return cond()
+
+    def test_result(self):
+        results = []
+        self.worker.submit(lambda x: x * 2, 21, on_done=results.append)
+        self.assertTrue(self.run_until(lambda: results))
+        self.assertEqual(results, [42])
+
+    def test_stale_result_discarded(self):
+        results = []
+        release = threading.Event()
+        self.worker.submit(release.wait, key='k', on_done=lambda r: results.append('old'))
+        self.worker.submit(lambda: 'new', key='k', on_done=results.append)
+        release.set()
+        self.assertTrue(self.run_until(lambda: results))
+        self.assertEqual(results, ['new'])
+
+    def test_raising_callback_keeps_polling(self):
+        results = []
+        release = threading.Event()
+
+        def fail(result):
+            raise RuntimeError("callback failed")
+
+        self.worker.submit(lambda: 1, on_done=fail)
+        self.worker.submit(release.wait, on_done=results.append)
+
+        # The first callback raises, as Tk would see it
+        with self.assertRaises(RuntimeError):
+            while True:
+                self.widget.run_after()
+                time.sleep(0.01)
+
+        # ...but the second result is still delivered, without another submit
+        release.set()
+        self.assertTrue(self.run_until(lambda: results))
+        self.assertEqual(results, [True])
+
+if __name__ == "__main__":
+    unittest.main()
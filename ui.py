@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 import copy
 import datetime
 from PIL import ImageTk, ImageOps
@@ -7,12 +8,19 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import font as tkfont
 
-from label import Label
+from label import Label, LineFitCache, rasterize
 from printer import DisplayPrinter
+from worker import BackgroundWorker
 
 import time
 
 UPDATE_DELAY=200
+# How long after the last preview update to render the full resolution label
+PRERENDER_DELAY=500
+
+# All labels are laid out and rendered on this one thread, so that typing
+# never waits for it, and fonts are never used from two threads at once.
+render_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
 
 class LabelPreview(tk.Frame):
     def __init__(self, master=None, width=400, dpi=300, size_mm=(89, 36), padding_mm=(0, 0, 0, 0)):
@@ -32,8 +40,19 @@ class LabelPreview(tk.Frame):
         self.canvas_height = int(width * self.aspect_ratio)
         self.dpi = dpi
 
+        # The label is laid out once at the printer resolution, and the
+        # preview draws that layout at the canvas resolution, so it matches
+        # what's printed. The printer resolution image is only rendered when
+        # it's needed for printing, or once updates go quiet.
+        self.preview_dpi = self.canvas_width / (self.size_mm[0] / 25.4)
+        self.prerender_id = None
+        self.renderer = BackgroundWorker(self, render_executor)
+        # Only used from the render thread
+        self.fit_cache = LineFitCache()
+
         self.canvas = tk.Canvas(self, width=self.canvas_width, height=self.canvas_height, background='white', bd=0)
         self.canvas.pack()
+        self.canvas_image = None
         self.lines = ['']
         self.update(self.lines)
 
@@ -42,17 +61,53 @@ class LabelPreview(tk.Frame):
             return
         self.lines = copy.deepcopy(lines)
 
-        self.lbl = Label(lines, dpi=self.dpi,
-                         size_mm=self.size_mm,
-                         padding_mm=self.padding_mm)
-        img = self.lbl.image()
-        img = img.resize((self.canvas_width, self.canvas_height))
+        # Only the newest preview is shown. Older ones still queued are
+        # skipped, and any which finish late are discarded.
+        self.renderer.submit(self.__render_preview, self.lines,
+                             key='preview', on_done=self.__show_preview)
+
+        if self.prerender_id:
+            self.after_cancel(self.prerender_id)
+        self.prerender_id = self.after(PRERENDER_DELAY, self.__prerender)
+
+    # Runs on the render thread
+    def __render_preview(self, lines):
+        lbl = Label(lines, dpi=self.dpi,
+                    size_mm=self.size_mm,
+                    padding_mm=self.padding_mm,
+                    fit_cache=self.fit_cache)
+        img = rasterize(lbl.layout(), self.preview_dpi)
+        if img.size != (self.canvas_width, self.canvas_height):
+            # Rounding mm to pixels can leave it a pixel out
+            img = img.resize((self.canvas_width, self.canvas_height))
+        return img
+
+    def __show_preview(self, img):
         self.bmp = ImageTk.BitmapImage(img, foreground='white')
-        self.canvas.create_rectangle(0, 0, self.canvas.winfo_reqwidth(), self.canvas.winfo_reqheight(), fill='black')
-        self.canvas.create_image(self.canvas.winfo_reqwidth() / 2, self.canvas.winfo_reqheight() / 2, image=self.bmp)
 
+        if self.canvas_image is None:
+            self.canvas.create_rectangle(0, 0, self.canvas.winfo_reqwidth(), self.canvas.winfo_reqheight(), fill='black')
+            self.canvas_image = self.canvas.create_image(self.canvas.winfo_reqwidth() / 2, self.canvas.winfo_reqheight() / 2)
+        self.canvas.itemconfigure(self.canvas_image, image=self.bmp)
+
+    # Speculatively render at full resolution, so that printing is instant
+    # (the layout and rendered label are cached)
+    def __prerender(self):
+        self.prerender_id = None
+        self.renderer.submit(self.__render, self.lines, key='prerender')
+
+    # Runs on the render thread
+    def __render(self, lines):
+        lbl = Label(lines, dpi=self.dpi,
+                    size_mm=self.size_mm,
+                    padding_mm=self.padding_mm,
+                    fit_cache=self.fit_cache)
+        return lbl.image()
+
+    # Blocks until the full resolution label has been rendered (which is
+    # immediate if the prerender has finished)
     def image(self):
-        return self.lbl.image()
+        return self.renderer.run(self.__render, self.lines)
 
 class UpdateDelayer():
     def __init__(self, parent, update_cb, update_delay_ms=UPDATE_DELAY):
@@ -120,7 +175,7 @@ class NameBadgeUI(tk.Frame):
         print("Printing...")
         self.update_preview()
         img = self.preview.image()
-        self.printer.print_image(img, thread=True)
+        self.printer.print_image(img)
 
     def create_widgets(self):
         row = 0
@@ -174,11 +229,12 @@ class NameBadgeUI(tk.Frame):
         self.populate("Your Name", "Your Comment")
 
 class DatabaseUI(tk.Frame):
-    def __init__(self, master=None, db=None, printer=DisplayPrinter()):
+    def __init__(self, master=None, db=None, printer=DisplayPrinter(), dbworker=None):
         super().__init__(master)
         self.master = master
         self.printer = printer
         self.db = db
+        self.dbworker = dbworker
         self.create_widgets()
         self.updater = UpdateDelayer(self, self.update_preview)
         self.update_preview()
@@ -278,16 +334,32 @@ class DatabaseUI(tk.Frame):
         name = self.namevar.get()
         comment = self.commentvar.get()
 
+        if self.dbworker:
+            # Save in the background, the form stays locked until it's done
+            self.save['state'] = 'disabled'
+            self.dbworker.submit(self.__save, tag, name, comment,
+                                 on_done=lambda _: self.__saved(),
+                                 on_error=self.__save_failed)
+        else:
+            self.__save(tag, name, comment)
+            self.__saved()
+
+    def __save(self, tag, name, comment):
         try:
             self.db.update(tag, name, comment)
         except:
             self.db.insert(tag, name, comment)
 
+    def __saved(self):
         self.tagvar.set("Scan a tag while holding left button")
         self.namebox['state'] = 'disabled'
         self.commentbox['state'] = 'disabled'
         self.save['state'] = 'disabled'
 
+    def __save_failed(self, e):
+        print("Save failed:", e)
+        self.save['state'] = 'normal'
+
     def populate(self, tag, name="Your Name", comment="Your Comment"):
         if not self.db:
             # Can't do anything without a database
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import queue
+
+# How often to check for results while calls are outstanding
+POLL_INTERVAL_MS = 10
+
+# Runs slow calls (database lookups, label rendering) off the Tk thread.
+#
+# Calls run one at a time on a single worker thread (so a sqlite connection
+# or a font is only ever used from one thread at once). Their results are
+# queued, and the Tk thread picks them up with after() and calls the on_done
+# or on_error callbacks. The worker thread never touches Tk itself, so it
+# doesn't matter whether the mainloop is running yet.
+#
+# Calls submitted with the same 'key' supersede each other: a call which
+# hasn't started by the time a newer one is submitted is skipped, and if a
+# newer call has been submitted by the time a result arrives, it's discarded.
+#
+# Several workers can share one executor (and so one thread), by passing it
+# in.
+class BackgroundWorker():
+    def __init__(self, widget, executor=None):
+        self.widget = widget
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.executor = executor
+        self.results = queue.Queue()
+        self.generations = {}
+        self.outstanding = 0
+        self.poll_id = None
+
+    # Call func(*args) on the worker thread. Must be called from the Tk thread.
+    def submit(self, func, *args, key=None, on_done=None, on_error=None):
+        generation = None
+        if key is not None:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+
+        future = self.executor.submit(self.__run, key, generation, func, args)
+        future.add_done_callback(
+            lambda f: self.results.put((key, generation, f, on_done, on_error)))
+
+        self.outstanding += 1
+        if self.poll_id is None:
+            self.poll_id = self.widget.after(POLL_INTERVAL_MS, self.__poll)
+
+    # Call func(*args) on the worker thread, and wait for the result.
+    # For when the Tk thread can't continue without it, e.g. printing.
+    def run(self, func, *args):
+        return self.executor.submit(func, *args).result()
+
+    # Discard the result of any outstanding call with this key
+    def invalidate(self, key):
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def __is_stale(self, key, generation):
+        return key is not None and generation != self.generations[key]
+
+    def __run(self, key, generation, func, args):
+        if self.__is_stale(key, generation):
+            # Superseded before it started, don't bother
+            return None
+        return func(*args)
+
+    def __poll(self):
+        self.poll_id = None
+        try:
+            while True:
+                try:
+                    key, generation, future, on_done, on_error = self.results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.outstanding -= 1
+                if self.__is_stale(key, generation):
+                    continue
+
+                error = future.exception()
+                if error:
+                    if on_error:
+                        on_error(error)
+                    else:
+                        print("Background call failed:", error)
+                elif on_done:
+                    on_done(future.result())
+        finally:
+            # Even if a callback raised (which Tk will report), keep polling
+            # for the other calls' results
+            if self.outstanding > 0 and self.poll_id is None:
+                self.poll_id = self.widget.after(POLL_INTERVAL_MS, self.__poll)
+
+    def shutdown(self):
+        if self.poll_id is not None:
+            self.widget.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.executor.shutdown(wait=True, cancel_futures=True)